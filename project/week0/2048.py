@@ -4,6 +4,13 @@ Clone of 2048 game.
 
 import poc_2048_gui  
 import random
+import time
+
+# numpy is only needed by BatchTwentyFortyEight
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # Directions, DO NOT MODIFY
 UP = 1
@@ -37,6 +44,22 @@ def merge(line):
     newline = push_left(newline)
     return newline
 
+def merge_with_score(line):
+    """
+    Same as merge, but also returns the number of merges
+    and the score gained (sum of the merged tiles)
+    """
+    newline = push_left(line)
+    num_merges = 0
+    score = 0
+    for index in range(len(newline) - 1):
+        if newline[index] != 0 and newline[index] == newline[index+1]:
+            newline[index] = 2 * newline[index]
+            newline[index+1] = 0
+            num_merges += 1
+            score += newline[index]
+    return (push_left(newline), num_merges, score)
+
 def push_left(line):
     """
     push the none zero tiles to left in the list
@@ -49,6 +72,51 @@ def push_left(line):
         newline.append(0)
     return newline
 
+class EmptyCells:
+    """
+    Indexable set of cells with O(1) add, remove and random choice.
+    """
+    
+    def __init__(self):
+        self._cells = []
+        self._positions = {}
+    
+    def __len__(self):
+        return len(self._cells)
+    
+    def __contains__(self, cell):
+        return cell in self._positions
+    
+    def __iter__(self):
+        return iter(self._cells)
+    
+    def add(self, cell):
+        """
+        Add a cell, does nothing if it is already in the set
+        """
+        if cell not in self._positions:
+            self._positions[cell] = len(self._cells)
+            self._cells.append(cell)
+    
+    def remove(self, cell):
+        """
+        Remove a cell, does nothing if it is not in the set.
+        The last cell takes the place of the removed one.
+        """
+        position = self._positions.pop(cell, None)
+        if position == None:
+            return
+        last = self._cells.pop()
+        if position != len(self._cells):
+            self._cells[position] = last
+            self._positions[last] = position
+    
+    def random_choice(self):
+        """
+        Return a random cell of the set
+        """
+        return self._cells[random.randint(0, len(self._cells) - 1)]
+
 class TwentyFortyEight:
     """
     Class to run the game logic.
@@ -72,6 +140,12 @@ class TwentyFortyEight:
         Reset the game so the grid is empty.
         """
         self.grid = [[0 for dummy_col in range(self.grid_width)] for dummy_row in range(self.grid_height)]  
+        self.empty_cells = EmptyCells()
+        for row in range(self.grid_height):
+            for col in range(self.grid_width):
+                self.empty_cells.add((row, col))
+        # number of pairs of neighbor tiles with the same non zero value
+        self.num_merge_pairs = 0
     
     def __str__(self):
         """
@@ -96,69 +170,126 @@ class TwentyFortyEight:
         """
         return self.grid_width
                             
-    def move(self, direction):
+    def preview_move(self, direction):
         """
-        Move all tiles in the given direction and add
-        a new tile if any tiles moved.
+        Compute the result of moving all tiles in the given direction
+        without changing the grid.
+        
+        Returns a dictionary with:
+            "moved": True if any tile moved,
+            "changed": list of (row, col, new value) for changed tiles,
+            "merges": number of merges performed,
+            "score": score gained (sum of the merged tiles).
         """
-        row = 0
-        col = 0
+        changed = []
+        num_merges = 0
+        score = 0
         lenth = 0
         if direction <= 2:
             lenth = self.grid_height
         else:
             lenth = self.grid_width
+        offset = OFFSETS[direction]
         for init_tile_indice in self.init_tile_indices.get(direction):
+            cells = []
             tmp_list = []
             row = init_tile_indice[0]
             col = init_tile_indice[1]
-            # step 1
             for dummy_index in range(lenth):
-                tmp_list.append(self.get_tile(row, col))
-                row += OFFSETS.get(direction)[0]
-                col += OFFSETS.get(direction)[1]
-            # step 2
-            tmp_list = merge(tmp_list)
-            # step 3
-            row = init_tile_indice[0]
-            col = init_tile_indice[1]
+                cells.append((row, col))
+                tmp_list.append(self.grid[row][col])
+                row += offset[0]
+                col += offset[1]
+            new_list, line_merges, line_score = merge_with_score(tmp_list)
+            num_merges += line_merges
+            score += line_score
             for index in range(lenth):
-                self.set_tile(row, col, tmp_list[index])
-                row += OFFSETS.get(direction)[0]
-                col += OFFSETS.get(direction)[1]
-        self.new_tile()
+                if new_list[index] != tmp_list[index]:
+                    changed.append((cells[index][0], cells[index][1], new_list[index]))
+        return {"moved": len(changed) != 0,
+                "changed": changed,
+                "merges": num_merges,
+                "score": score}
+                            
+    def move(self, direction):
+        """
+        Move all tiles in the given direction and add
+        a new tile if any tiles moved.
+        
+        Returns the dictionary of preview_move, with an extra
+        "new_tile" entry holding the (row, col, value) of the
+        added tile (None if no tile was added).
+        """
+        delta = self.preview_move(direction)
+        delta["new_tile"] = None
+        if delta["moved"]:
+            for row, col, value in delta["changed"]:
+                self.set_tile(row, col, value)
+            delta["new_tile"] = self.new_tile()
+        return delta
         
     def new_tile(self):
         """
         Create a new tile in a randomly selected empty 
         square.  The tile should be 2 90% of the time and
         4 10% of the time.
+
+        Returns the (row, col, value) of the new tile, or None
+        if the grid is full.
         """
-        zero_list = []
-        row = 0
-        col = 0
-        new_num = 0
-        lenth = self.grid_height
-        for init_tile_indice in self.init_tile_indices.get(UP):
-            row = init_tile_indice[0]
-            col = init_tile_indice[1]
-            for dummy_index in range(lenth):
-                if self.get_tile(row, col) == 0:
-                    zero_list.append((row, col))
-                row += OFFSETS.get(UP)[0]
-                col += OFFSETS.get(UP)[1]
-        if (len(zero_list) != 0):
-            new_num = random.randint(0, len(zero_list) - 1)
-            if random.random() < 0.1:
-                self.set_tile(zero_list[new_num][0], zero_list[new_num][1], 4)
-            else:
-                self.set_tile(zero_list[new_num][0], zero_list[new_num][1], 2)
+        if len(self.empty_cells) == 0:
+            return None
+        cell = self.empty_cells.random_choice()
+        value = 2
+        if random.random() < 0.1:
+            value = 4
+        self.set_tile(cell[0], cell[1], value)
+        return (cell[0], cell[1], value)
+    
+    def has_moves(self):
+        """
+        Return True if a move can change the grid.
+        """
+        return len(self.empty_cells) != 0 or self.num_merge_pairs != 0
+    
+    def is_game_over(self):
+        """
+        Return True if no move can change the grid.
+        """
+        return not self.has_moves()
+    
+    def count_merge_pairs(self, row, col):
+        """
+        Return the number of neighbors of tile (row, col) with the 
+        same non zero value.
+        """
+        value = self.grid[row][col]
+        if value == 0:
+            return 0
+        count = 0
+        if row > 0 and self.grid[row - 1][col] == value:
+            count += 1
+        if row < self.grid_height - 1 and self.grid[row + 1][col] == value:
+            count += 1
+        if col > 0 and self.grid[row][col - 1] == value:
+            count += 1
+        if col < self.grid_width - 1 and self.grid[row][col + 1] == value:
+            count += 1
+        return count
         
     def set_tile(self, row, col, value):
         """
         Set the tile at position row, col to have the given value.
         """        
+        if self.grid[row][col] == value:
+            return
+        self.num_merge_pairs -= self.count_merge_pairs(row, col)
         self.grid[row][col] = value
+        self.num_merge_pairs += self.count_merge_pairs(row, col)
+        if value == 0:
+            self.empty_cells.add((row, col))
+        else:
+            self.empty_cells.remove((row, col))
 
     def get_tile(self, row, col):
         """
@@ -166,4 +297,675 @@ class TwentyFortyEight:
         """        
         return self.grid[row][col]
 
+# Bitboard version of the game, only for 4x4 grids.
+# Each tile is stored as log2 of its value in 4 bits, so a row
+# fits in 16 bits and the whole board in a 64 bit integer.
+# Tile (row, col) lives at bit 4 * (4 * row + col).
+ROW_MASK = 0xFFFF
+ROW_LEFT_TABLE = []
+ROW_RIGHT_TABLE = []
+
+def reverse_row(row):
+    """
+    Reverse the order of the four tiles of a 16 bit row
+    """
+    return (((row >> 12) & 0xF) | ((row >> 4) & 0xF0) |
+            ((row << 4) & 0xF00) | ((row << 12) & 0xF000))
+
+def merge_row_exponents(line):
+    """
+    Same as merge, but on a list of tile exponents (0 means empty).
+    Raises ValueError if two 2^15 tiles merge, since the result
+    does not fit in 4 bits.
+    """
+    newline = [exp for exp in line if exp != 0]
+    result = []
+    index = 0
+    while index < len(newline):
+        if index + 1 < len(newline) and newline[index] == newline[index + 1]:
+            if newline[index] == 15:
+                raise ValueError("Tile 2^16 does not fit in the bitboard")
+            result.append(newline[index] + 1)
+            index += 2
+        else:
+            result.append(newline[index])
+            index += 1
+    while len(result) != len(line):
+        result.append(0)
+    return result
+
+def init_row_tables():
+    """
+    Precompute the result of moving every possible row left and right.
+    Rows that would merge two 2^15 tiles are stored as None, so that
+    move_board fails on them instead of returning a wrong board.
+    """
+    if len(ROW_LEFT_TABLE) != 0:
+        return
+    left_table = [0] * (ROW_MASK + 1)
+    for row in range(ROW_MASK + 1):
+        line = [(row >> (4 * col)) & 0xF for col in range(4)]
+        try:
+            line = merge_row_exponents(line)
+        except ValueError:
+            left_table[row] = None
+            continue
+        result = 0
+        for col in range(4):
+            result |= line[col] << (4 * col)
+        left_table[row] = result
+    right_table = [0] * (ROW_MASK + 1)
+    for row in range(ROW_MASK + 1):
+        result = left_table[reverse_row(row)]
+        if result != None:
+            result = reverse_row(result)
+        right_table[row] = result
+    ROW_LEFT_TABLE.extend(left_table)
+    ROW_RIGHT_TABLE.extend(right_table)
+
+def check_row_tables():
+    """
+    Check the row tables against merge for every possible row.
+    Rows that would merge two 2^15 tiles must be None in the tables.
+    Returns the list of rows that do not match.
+    """
+    init_row_tables()
+    wrong_rows = []
+    for row in range(ROW_MASK + 1):
+        exps = [(row >> (4 * col)) & 0xF for col in range(4)]
+        line = [2 ** exp if exp != 0 else 0 for exp in exps]
+        overflow_left = 2 ** 16 in merge(line)
+        overflow_right = 2 ** 16 in merge(line[::-1])
+        if overflow_left or overflow_right:
+            if ((ROW_LEFT_TABLE[row] == None) != overflow_left or
+                    (ROW_RIGHT_TABLE[row] == None) != overflow_right):
+                wrong_rows.append(row)
+            continue
+        left = [(ROW_LEFT_TABLE[row] >> (4 * col)) & 0xF for col in range(4)]
+        right = [(ROW_RIGHT_TABLE[row] >> (4 * col)) & 0xF for col in range(4)]
+        if ([2 ** exp if exp != 0 else 0 for exp in left] != merge(line) or
+                [2 ** exp if exp != 0 else 0 for exp in right] != merge(line[::-1])[::-1]):
+            wrong_rows.append(row)
+    return wrong_rows
+
+def transpose_board(board):
+    """
+    Transpose a 64 bit board, so that columns become rows
+    """
+    part1 = board & 0xF0F00F0FF0F00F0F
+    part2 = board & 0x0000F0F00000F0F0
+    part3 = board & 0x0F0F00000F0F0000
+    board = part1 | (part2 << 12) | (part3 >> 12)
+    part1 = board & 0xFF00FF0000FF00FF
+    part2 = board & 0x00FF00FF00000000
+    part3 = board & 0x00000000FF00FF00
+    return part1 | (part2 >> 24) | (part3 << 24)
+
+def move_rows(board, table):
+    """
+    Apply a row table to the four rows of a 64 bit board
+    """
+    return (table[board & ROW_MASK] |
+            (table[(board >> 16) & ROW_MASK] << 16) |
+            (table[(board >> 32) & ROW_MASK] << 32) |
+            (table[(board >> 48) & ROW_MASK] << 48))
+
+def move_board(board, direction):
+    """
+    Return the 64 bit board after moving in the given direction.
+    Raises ValueError if the move would merge two 2^15 tiles.
+    """
+    try:
+        if direction == LEFT:
+            return move_rows(board, ROW_LEFT_TABLE)
+        elif direction == RIGHT:
+            return move_rows(board, ROW_RIGHT_TABLE)
+        elif direction == UP:
+            return transpose_board(move_rows(transpose_board(board), ROW_LEFT_TABLE))
+        else:
+            return transpose_board(move_rows(transpose_board(board), ROW_RIGHT_TABLE))
+    except TypeError:
+        # a row of the tables is None
+        raise ValueError("Tile 2^16 does not fit in the bitboard")
+
+def empty_cells(board):
+    """
+    Return the list of bit shifts of the empty tiles of a 64 bit board
+    """
+    return [shift for shift in range(0, 64, 4) if (board >> shift) & 0xF == 0]
+
+def board_delta(board, new_board):
+    """
+    Return the preview_move dictionary of a move from board to
+    new_board.  Each merge removes a tile, and building a 2^e tile
+    from 2s scores (e - 1) * 2^e, so the merge count and the score
+    come from the tiles of the two boards.
+    """
+    changed = []
+    num_merges = 0
+    score = 0
+    for shift in range(0, 64, 4):
+        exp = (board >> shift) & 0xF
+        new_exp = (new_board >> shift) & 0xF
+        if exp != 0:
+            num_merges += 1
+            score -= (exp - 1) << exp
+        if new_exp != 0:
+            num_merges -= 1
+            score += (new_exp - 1) << new_exp
+        if new_exp != exp:
+            row, col = divmod(shift // 4, 4)
+            value = 0
+            if new_exp != 0:
+                value = 1 << new_exp
+            changed.append((row, col, value))
+    return {"moved": len(changed) != 0,
+            "changed": changed,
+            "merges": num_merges,
+            "score": score}
+
+class TwentyFortyEightBitboard:
+    """
+    Class to run the game logic on a 4x4 bitboard.
+    Same interface as TwentyFortyEight.
+    """
+    
+    def __init__(self, grid_height = 4, grid_width = 4):
+        if grid_height != 4 or grid_width != 4:
+            raise ValueError("Bitboard only supports 4x4 grids")
+        self.grid_height = grid_height
+        self.grid_width = grid_width
+        init_row_tables()
+        self.reset()
+    
+    def reset(self):
+        """
+        Reset the game so the grid is empty.
+        """
+        self.board = 0
+    
+    def __str__(self):
+        """
+        Return a string representation of the grid for debugging.
+        """
+        grid_output = ""
+        for row in range(self.grid_height):  
+            for col in range(self.grid_width):  
+                grid_output += str(self.get_tile(row, col)) + " "
+            grid_output += "\n"
+        return grid_output
+
+    def get_grid_height(self):
+        """
+        Get the height of the board.
+        """
+        return self.grid_height
+    
+    def get_grid_width(self):
+        """
+        Get the width of the board.
+        """
+        return self.grid_width
+    
+    def preview_move(self, direction):
+        """
+        Compute the result of moving all tiles in the given direction
+        without changing the grid.  Same dictionary as
+        TwentyFortyEight.preview_move.
+        Raises ValueError if the move would merge two 2^15 tiles.
+        """
+        return board_delta(self.board, move_board(self.board, direction))
+    
+    def move(self, direction):
+        """
+        Move all tiles in the given direction and add
+        a new tile if any tiles moved.
+        
+        Returns the same dictionary as TwentyFortyEight.move.
+        """
+        new_board = move_board(self.board, direction)
+        delta = board_delta(self.board, new_board)
+        delta["new_tile"] = None
+        if delta["moved"]:
+            self.board = new_board
+            delta["new_tile"] = self.new_tile()
+        return delta
+    
+    def new_tile(self):
+        """
+        Create a new tile in a randomly selected empty 
+        square.  The tile should be 2 90% of the time and
+        4 10% of the time.
+
+        Returns the (row, col, value) of the new tile, or None
+        if the grid is full.
+        """
+        zero_list = empty_cells(self.board)
+        if len(zero_list) == 0:
+            return None
+        shift = random.choice(zero_list)
+        exp = 1
+        if random.random() < 0.1:
+            exp = 2
+        self.board |= exp << shift
+        row, col = divmod(shift // 4, 4)
+        return (row, col, 1 << exp)
+    
+    def set_tile(self, row, col, value):
+        """
+        Set the tile at position row, col to have the given value.
+        Raises ValueError if value is not 0 or a power of two
+        between 2 and 2^15.
+        """
+        shift = 4 * (4 * row + col)
+        exp = 0
+        if value != 0:
+            exp = value.bit_length() - 1
+            if value < 2 or value != 1 << exp or exp > 15:
+                raise ValueError("Tile " + str(value) + " does not fit in the bitboard")
+        self.board = (self.board & ~(0xF << shift)) | (exp << shift)
+
+    def get_tile(self, row, col):
+        """
+        Return the value of the tile at position row, col.
+        """
+        exp = (self.board >> (4 * (4 * row + col))) & 0xF
+        if exp == 0:
+            return 0
+        return 2 ** exp
+
+# Expectimax AI for the bitboard game.
+# Row heuristic weights, the score of a board is the sum of the
+# score of its rows and of its columns.
+HEUR_EMPTY_WEIGHT = 270.0
+HEUR_MERGES_WEIGHT = 700.0
+HEUR_MONOTONICITY_POWER = 4.0
+HEUR_MONOTONICITY_WEIGHT = 47.0
+HEUR_SUM_POWER = 3.5
+HEUR_SUM_WEIGHT = 11.0
+HEUR_LOST_PENALTY = 200000.0
+HEUR_TABLE = []
+
+# Spawn probabilities, same as new_tile
+SPAWN_TWO_PROB = 0.9
+SPAWN_FOUR_PROB = 0.1
+
+# Chance nodes reached with a lower probability are not expanded
+CPROB_THRESHOLD = 0.0001
+
+# Part of the time budget kept for the nodes searched between the
+# last clock check and the end of the search
+SEARCH_TIME_MARGIN = 0.1
+
+def init_heuristic_table():
+    """
+    Precompute the heuristic score of every possible row
+    """
+    if len(HEUR_TABLE) != 0:
+        return
+    table = [0.0] * (ROW_MASK + 1)
+    for row in range(ROW_MASK + 1):
+        line = [(row >> (4 * col)) & 0xF for col in range(4)]
+        sum_score = 0.0
+        empty = 0
+        merges = 0
+        prev = 0
+        counter = 0
+        for exp in line:
+            sum_score += exp ** HEUR_SUM_POWER
+            if exp == 0:
+                empty += 1
+            else:
+                if prev == exp:
+                    counter += 1
+                elif counter > 0:
+                    merges += 1 + counter
+                    counter = 0
+                prev = exp
+        if counter > 0:
+            merges += 1 + counter
+        mono_left = 0.0
+        mono_right = 0.0
+        for col in range(1, 4):
+            if line[col - 1] > line[col]:
+                mono_left += (line[col - 1] ** HEUR_MONOTONICITY_POWER -
+                              line[col] ** HEUR_MONOTONICITY_POWER)
+            else:
+                mono_right += (line[col] ** HEUR_MONOTONICITY_POWER -
+                               line[col - 1] ** HEUR_MONOTONICITY_POWER)
+        table[row] = (HEUR_LOST_PENALTY + HEUR_EMPTY_WEIGHT * empty +
+                      HEUR_MERGES_WEIGHT * merges -
+                      HEUR_MONOTONICITY_WEIGHT * min(mono_left, mono_right) -
+                      HEUR_SUM_WEIGHT * sum_score)
+    HEUR_TABLE.extend(table)
+
+def score_heuristic(board):
+    """
+    Heuristic score of a 64 bit board
+    """
+    transposed = transpose_board(board)
+    score = 0.0
+    for shift in (0, 16, 32, 48):
+        score += HEUR_TABLE[(board >> shift) & ROW_MASK]
+        score += HEUR_TABLE[(transposed >> shift) & ROW_MASK]
+    return score
+
+def to_bitboard(game):
+    """
+    Return the 64 bit board of a 4x4 game, which can be either a
+    TwentyFortyEight or a TwentyFortyEightBitboard object.
+    Raises ValueError for any other grid size.
+    """
+    if isinstance(game, TwentyFortyEightBitboard):
+        return game.board
+    if game.get_grid_height() != 4 or game.get_grid_width() != 4:
+        raise ValueError("Expectimax only supports 4x4 grids")
+    board = TwentyFortyEightBitboard()
+    for row in range(4):
+        for col in range(4):
+            board.set_tile(row, col, game.get_tile(row, col))
+    return board.board
+
+class SearchTimeout(Exception):
+    """
+    Raised inside the search when the time budget runs out.
+    """
+    pass
+
+class ExpectimaxSolver:
+    """
+    Expectimax search over the 4x4 bitboard game.
+    Max nodes are the player moves, chance nodes are the 2/4 spawns.
+    Searches with iterative deepening until max_depth is reached or
+    time_limit (seconds) runs out, whichever comes first.
+    """
+    
+    def __init__(self, max_depth = 6, time_limit = 0.01, table_size = 100000):
+        init_row_tables()
+        init_heuristic_table()
+        self.max_depth = max_depth
+        self.time_limit = time_limit
+        self.table_size = table_size
+        # board -> depth and board -> score, kept as two dictionaries
+        # of numbers so the garbage collector has nothing to scan
+        self.trans_depth = {}
+        self.trans_score = {}
+        self.deadline = None
+        self.nodes = 0
+        self.table_hits = 0
+        self.depth_reached = 0
+    
+    def best_move(self, game):
+        """
+        Return the best direction for the given game, or None if no
+        move is possible.  Raises ValueError if the game is not 4x4.
+        """
+        start = time.time()
+        board = to_bitboard(game)
+        self.nodes = 0
+        self.table_hits = 0
+        self.depth_reached = 0
+        self.deadline = None
+        if self.time_limit != None:
+            # keep a margin for the nodes searched after the last check
+            self.deadline = start + self.time_limit * (1.0 - SEARCH_TIME_MARGIN)
+        best_direction = None
+        # the table is kept between depths and moves, its entries
+        # know the depth they were searched at
+        for depth in range(1, self.max_depth + 1):
+            try:
+                direction = self.search_root(board, depth)
+            except SearchTimeout:
+                break
+            if direction == None:
+                break
+            best_direction = direction
+            self.depth_reached = depth
+        return best_direction
+    
+    def search_root(self, board, depth):
+        """
+        Return the best direction when searching depth moves ahead
+        """
+        best_direction = None
+        best_score = -1.0
+        for direction in (UP, DOWN, LEFT, RIGHT):
+            try:
+                new_board = move_board(board, direction)
+            except ValueError:
+                # merging two 2^15 tiles is not playable on the bitboard
+                continue
+            if new_board == board:
+                continue
+            score = self.chance_node(new_board, depth, 1.0)
+            if score > best_score:
+                best_score = score
+                best_direction = direction
+        return best_direction
+    
+    def count_node(self):
+        """
+        Count a searched node and check the time budget every
+        few nodes, leaves included
+        """
+        self.nodes += 1
+        if self.deadline != None and self.nodes % 8 == 0:
+            if time.time() > self.deadline:
+                raise SearchTimeout()
+    
+    def max_node(self, board, depth, prob):
+        """
+        Score of the best move from the given board
+        """
+        self.count_node()
+        best_score = 0.0
+        for direction in (UP, DOWN, LEFT, RIGHT):
+            try:
+                new_board = move_board(board, direction)
+            except ValueError:
+                continue
+            if new_board != board:
+                best_score = max(best_score, self.chance_node(new_board, depth, prob))
+        return best_score
+    
+    def chance_node(self, board, depth, prob):
+        """
+        Expected score over all the possible new tiles
+        """
+        self.count_node()
+        if depth <= 1 or prob < CPROB_THRESHOLD:
+            return score_heuristic(board)
+        if self.trans_depth.get(board, 0) >= depth:
+            self.table_hits += 1
+            return self.trans_score[board]
+        zero_list = empty_cells(board)
+        num_empty = len(zero_list)
+        score = 0.0
+        for shift in zero_list:
+            score += SPAWN_TWO_PROB * self.max_node(
+                board | (1 << shift), depth - 1, prob * SPAWN_TWO_PROB / num_empty)
+            score += SPAWN_FOUR_PROB * self.max_node(
+                board | (2 << shift), depth - 1, prob * SPAWN_FOUR_PROB / num_empty)
+        score /= num_empty
+        if len(self.trans_depth) >= self.table_size:
+            self.trans_depth.clear()
+            self.trans_score.clear()
+        self.trans_depth[board] = depth
+        self.trans_score[board] = score
+        return score
+
+def best_move(game, max_depth = 6, time_limit = 0.01):
+    """
+    Return the best direction for the given 4x4 game
+    """
+    return ExpectimaxSolver(max_depth, time_limit).best_move(game)
+
+def run_ai(game, max_moves = 10000):
+    """
+    Let the expectimax AI play the given game until no move is left.
+    Returns the number of moves played.
+    """
+    solver = ExpectimaxSolver()
+    num_moves = 0
+    while num_moves < max_moves:
+        direction = solver.best_move(game)
+        if direction == None:
+            break
+        game.move(direction)
+        num_moves += 1
+    return num_moves
+
+class BatchTwentyFortyEight:
+    """
+    Class to run many games at once, all the grids are stored in
+    a single numpy array of shape (num_boards, grid_height, grid_width).
+    """
+    
+    def __init__(self, num_boards, grid_height, grid_width, seed = None):
+        if numpy == None:
+            raise ImportError("BatchTwentyFortyEight needs numpy")
+        self.num_boards = num_boards
+        self.grid_height = grid_height
+        self.grid_width = grid_width
+        self.rand = numpy.random.RandomState(seed)
+        self.reset()
+    
+    def reset(self):
+        """
+        Reset all the games so the grids are empty.
+        """
+        self.grids = numpy.zeros((self.num_boards, self.grid_height, 
+                                  self.grid_width), dtype = numpy.int64)
+        self.scores = numpy.zeros(self.num_boards, dtype = numpy.int64)
+    
+    def get_grid_height(self):
+        """
+        Get the height of the boards.
+        """
+        return self.grid_height
+    
+    def get_grid_width(self):
+        """
+        Get the width of the boards.
+        """
+        return self.grid_width
+    
+    def oriented(self, grids, direction):
+        """
+        Return a view of the grids where the given direction
+        is a move to the left.
+        """
+        if direction == UP:
+            return grids.transpose(0, 2, 1)
+        elif direction == DOWN:
+            return grids.transpose(0, 2, 1)[:, :, ::-1]
+        elif direction == RIGHT:
+            return grids[:, :, ::-1]
+        return grids
+    
+    def move_grids(self, grids, direction):
+        """
+        Move the given grids in the given direction.
+        Returns the new grids and the score gained by each grid.
+        """
+        lines = self.oriented(grids, direction)
+        shape = lines.shape
+        lines = push_left_lines(lines.reshape(-1, shape[2]))
+        gained = numpy.zeros(lines.shape[0], dtype = numpy.int64)
+        for index in range(shape[2] - 1):
+            same = (lines[:, index] == lines[:, index + 1]) & (lines[:, index] != 0)
+            lines[same, index] *= 2
+            lines[same, index + 1] = 0
+            gained[same] += lines[same, index]
+        lines = push_left_lines(lines).reshape(shape)
+        gained = gained.reshape(shape[0], shape[1]).sum(axis = 1)
+        new_grids = numpy.empty_like(grids)
+        self.oriented(new_grids, direction)[...] = lines
+        return new_grids, gained
+    
+    def move(self, direction):
+        """
+        Move all the boards in the given direction, which can also be
+        an array with one direction per board, and add a new tile on 
+        the boards where tiles moved.
+        Returns a boolean array telling which boards moved.
+        """
+        directions = numpy.broadcast_to(numpy.asarray(direction), 
+                                        (self.num_boards,))
+        moved = numpy.zeros(self.num_boards, dtype = bool)
+        for dir_item in (UP, DOWN, LEFT, RIGHT):
+            selected = numpy.nonzero(directions == dir_item)[0]
+            if len(selected) == 0:
+                continue
+            old_grids = self.grids[selected]
+            new_grids, gained = self.move_grids(old_grids, dir_item)
+            self.grids[selected] = new_grids
+            self.scores[selected] += gained
+            moved[selected] = (new_grids != old_grids).reshape(len(selected), -1).any(axis = 1)
+        self.new_tile(moved)
+        return moved
+    
+    def new_tile(self, selected = None):
+        """
+        Create a new tile in a randomly selected empty square of
+        every board (or of the boards where selected is True).
+        The tile should be 2 90% of the time and 4 10% of the time.
+        """
+        flat = self.grids.reshape(self.num_boards, -1)
+        empty = flat == 0
+        has_empty = empty.any(axis = 1)
+        if selected is not None:
+            has_empty &= selected
+        # the empty square with the highest random key is uniformly chosen
+        keys = self.rand.random_sample(flat.shape)
+        keys[~empty] = -1.0
+        cells = keys.argmax(axis = 1)
+        values = numpy.where(self.rand.random_sample(self.num_boards) < 0.1, 4, 2)
+        boards = numpy.nonzero(has_empty)[0]
+        flat[boards, cells[boards]] = values[boards]
+    
+    def get_scores(self):
+        """
+        Return the score of every board.
+        """
+        return self.scores.copy()
+    
+    def max_tiles(self):
+        """
+        Return the largest tile of every board.
+        """
+        return self.grids.reshape(self.num_boards, -1).max(axis = 1)
+    
+    def game_over(self):
+        """
+        Return a boolean array telling which boards have no move left.
+        """
+        grids = self.grids
+        can_move = (grids == 0).reshape(self.num_boards, -1).any(axis = 1)
+        same_row = (grids[:, :, 1:] == grids[:, :, :-1])
+        same_col = (grids[:, 1:, :] == grids[:, :-1, :])
+        can_move |= same_row.reshape(self.num_boards, -1).any(axis = 1)
+        can_move |= same_col.reshape(self.num_boards, -1).any(axis = 1)
+        return ~can_move
+    
+    def set_tile(self, board, row, col, value):
+        """
+        Set the tile at position row, col of the given board.
+        """
+        self.grids[board, row, col] = value
+    
+    def get_tile(self, board, row, col):
+        """
+        Return the value of the tile at position row, col of the 
+        given board.
+        """
+        return int(self.grids[board, row, col])
+
+def push_left_lines(lines):
+    """
+    push the none zero tiles to left in every row of a 2D array
+    """
+    order = numpy.argsort(lines == 0, axis = 1, kind = "mergesort")
+    return numpy.take_along_axis(lines, order, axis = 1)
+
 poc_2048_gui.run_gui(TwentyFortyEight(4, 4))
\ No newline at end of file
@@ -2,29 +2,302 @@
 Cookie Clicker Simulator
 """
 
-import simpleplot
+# simpleplot and codeskulptor only exist in CodeSkulptor, the
+# tournament runner works without them
+try:
+    import simpleplot
+except ImportError:
+    simpleplot = None
 
 # Used to increase the timeout, if necessary
-import codeskulptor
+try:
+    import codeskulptor
+    codeskulptor.set_timeout(20)
+except ImportError:
+    codeskulptor = None
+import bisect
 import math
-codeskulptor.set_timeout(20)
+import random
+import time
+
+# only needed by the tournament runner
+try:
+    import csv
+    import json
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+# array is only needed by ColumnarHistory
+try:
+    import array
+except ImportError:
+    array = None
 
 import poc_clicker_provided as provided
 
 # Constants
 SIM_TIME = 10000000000.0
 
+def expand_run(time, item, cost, growth, count, total):
+    """
+    Generate the history tuples of count purchases of item made at
+    the same time, the first one costing cost and each next one
+    growth times more
+    """
+    # repeated products, as in buy_item_run, so the costs are exact
+    for dummy_index in range(count):
+        yield (time, item, cost, total)
+        cost *= growth
+
+class FullHistory:
+    """
+    History backend keeping every purchase.
+    Runs of purchases are kept as one record until asked for.
+    """
+
+    def __init__(self):
+        self._entries = []
+        self._has_runs = False
+
+    def __len__(self):
+        if not self._has_runs:
+            return len(self._entries)
+        return len(self.get_entries())
+
+    def append(self, entry):
+        """
+        Add a (time, item, cost, total cookies) tuple
+        """
+        self._entries.append(entry)
+
+    def append_run(self, time, item, cost, growth, count, total):
+        """
+        Add count purchases of item made at the same time, see expand_run
+        """
+        self._entries.append((time, item, cost, growth, count, total))
+        self._has_runs = True
+
+    def get_entries(self):
+        """
+        Return the list of (time, item, cost, total cookies) tuples
+        """
+        if not self._has_runs:
+            return self._entries
+        entries = []
+        for record in self._entries:
+            if len(record) == 4:
+                entries.append(record)
+            else:
+                entries.extend(expand_run(*record))
+        return entries
+
+class StrideHistory:
+    """
+    History backend keeping at most max_entries evenly spaced
+    purchases: every stride-th purchase is kept, and the stride
+    doubles (dropping every other kept entry) when the history is
+    full.  The last purchase is always kept.
+    """
+
+    def __init__(self, max_entries = 1000):
+        self._max_entries = max(max_entries, 2)
+        self._stride = 1
+        self._count = 0
+        self._entries = []
+        self._last = None
+
+    def __len__(self):
+        return len(self.get_entries())
+
+    def get_count(self):
+        """
+        Return the number of entries added, kept or not
+        """
+        return self._count
+
+    def append(self, entry):
+        """
+        Add a (time, item, cost, total cookies) tuple
+        """
+        if self._count % self._stride == 0:
+            self._entries.append(entry)
+            if len(self._entries) > self._max_entries:
+                self._entries = self._entries[::2]
+                self._stride *= 2
+        self._last = entry
+        self._count += 1
+
+    def append_run(self, time, item, cost, growth, count, total):
+        """
+        Add count purchases of item made at the same time, see expand_run
+        """
+        for entry in expand_run(time, item, cost, growth, count, total):
+            self.append(entry)
+
+    def get_entries(self):
+        """
+        Return the list of kept (time, item, cost, total cookies) tuples
+        """
+        entries = list(self._entries)
+        if self._last != None and self._last is not entries[-1]:
+            entries.append(self._last)
+        return entries
+
+class ReservoirHistory:
+    """
+    History backend keeping a uniform random sample of at most
+    max_entries purchases (reservoir sampling), in time order.
+    The first and last purchases are always kept.
+    """
+
+    def __init__(self, max_entries = 1000, seed = None):
+        self._max_entries = max(max_entries, 1)
+        self._rand = random.Random(seed)
+        self._count = 0
+        self._first = None
+        self._last = None
+        self._sample = []
+
+    def __len__(self):
+        return len(self.get_entries())
+
+    def append(self, entry):
+        """
+        Add a (time, item, cost, total cookies) tuple
+        """
+        if self._first == None:
+            self._first = entry
+        else:
+            if len(self._sample) < self._max_entries:
+                self._sample.append((self._count, entry))
+            else:
+                index = self._rand.randint(0, self._count)
+                if index < self._max_entries:
+                    self._sample[index] = (self._count, entry)
+            self._count += 1
+        self._last = entry
+
+    def append_run(self, time, item, cost, growth, count, total):
+        """
+        Add count purchases of item made at the same time, see expand_run
+        """
+        for entry in expand_run(time, item, cost, growth, count, total):
+            self.append(entry)
+
+    def get_sample(self):
+        """
+        Return the sampled purchases after the first one, in time
+        order, without the always kept last purchase
+        """
+        return [entry for dummy_index, entry in sorted(self._sample)]
+
+    def get_entries(self):
+        """
+        Return the list of kept (time, item, cost, total cookies) tuples
+        """
+        if self._first == None:
+            return []
+        entries = [self._first]
+        entries.extend(self.get_sample())
+        if self._last is not entries[-1]:
+            entries.append(self._last)
+        return entries
+
+def check_reservoir_history(max_entries = 3, num_entries = 10, trials = 60000):
+    """
+    Estimate how often each purchase after the first is kept by a
+    ReservoirHistory with max_entries slots over num_entries
+    purchases.  A uniform sample keeps each of them with probability
+    max_entries / num_entries; returns the largest deviation from it.
+    The last purchase is always kept, so only the sample is counted.
+    """
+    kept = [0] * num_entries
+    for seed in range(trials):
+        history = ReservoirHistory(max_entries, seed)
+        history.append("first")
+        for index in range(num_entries):
+            history.append(index)
+        for index in history.get_sample():
+            kept[index] += 1
+    expected = float(min(max_entries, num_entries)) / num_entries
+    return max(abs(float(count) / trials - expected) for count in kept)
+
+class ColumnarHistory:
+    """
+    History backend keeping every purchase in compact columns:
+    array('d') columns for time, cost and total cookies, and an
+    array('i') column of indices into the list of item names.
+    The tuples are only built by get_entries.
+    """
+
+    def __init__(self):
+        if array == None:
+            raise ImportError("ColumnarHistory needs the array module")
+        self._times = array.array("d")
+        self._costs = array.array("d")
+        self._totals = array.array("d")
+        self._items = array.array("i")
+        self._item_names = []
+        self._item_indices = {}
+
+    def __len__(self):
+        return len(self._times)
+
+    def item_index(self, item):
+        """
+        Return the index of the item name, adding it if it is new
+        """
+        index = self._item_indices.get(item)
+        if index == None:
+            index = len(self._item_names)
+            self._item_names.append(item)
+            self._item_indices[item] = index
+        return index
+
+    def append(self, entry):
+        """
+        Add a (time, item, cost, total cookies) tuple
+        """
+        self._times.append(entry[0])
+        self._items.append(self.item_index(entry[1]))
+        self._costs.append(entry[2])
+        self._totals.append(entry[3])
+
+    def append_run(self, time, item, cost, growth, count, total):
+        """
+        Add count purchases of item made at the same time, see expand_run
+        """
+        self._times.extend(array.array("d", [time]) * count)
+        self._items.extend(array.array("i", [self.item_index(item)]) * count)
+        self._costs.extend(entry[2] for entry in expand_run(time, item, cost, growth, count, total))
+        self._totals.extend(array.array("d", [total]) * count)
+
+    def get_entries(self):
+        """
+        Return the list of (time, item, cost, total cookies) tuples
+        """
+        names = self._item_names
+        return [(self._times[index], names[self._items[index]], 
+                 self._costs[index], self._totals[index])
+                for index in range(len(self._times))]
+
 class ClickerState:
     """
     Simple class to keep track of the game state.
+    history is the history backend (FullHistory, StrideHistory,
+    ReservoirHistory or ColumnarHistory), FullHistory by default.
     """
 
-    def __init__(self):
+    def __init__(self, history = None):
         self._total_cookies_generated = 0.0
         self._current_cookies = 0.0
         self._current_time = 0.0
         self._current_cps = 1.0
-        self._history = [(0.0, None, 0.0, 0.0)]
+        if history == None:
+            history = FullHistory()
+        self._history = history
+        self._history.append((0.0, None, 0.0, 0.0))
         
     def __str__(self):
         """
@@ -35,7 +308,8 @@ class ClickerState:
         tmp_str +="Cookies:\t" + str(self._current_cookies) + "\n"
         tmp_str +="Total Cookies:\t" + str(self._total_cookies_generated) + "\n"
         tmp_str +="CPS:\t" + str(self._current_cps) +"\n"
-        tmp_str +="History:\t" + str(self._history[0]) + "..."+ str(self._history[len(self._history)-2]) + str(self._history[len(self._history)-1]) +"\n"
+        history = self.get_history()
+        tmp_str +="History:\t" + str(history[0]) + "..."+ str(history[len(history)-2]) + str(history[len(history)-1]) +"\n"
         return tmp_str
         
     def get_cookies(self):
@@ -62,6 +336,14 @@ class ClickerState:
         Should return a float
         """
         return self._current_time
+
+    def get_total_cookies(self):
+        """
+        Get the total number of cookies generated
+
+        Should return a float
+        """
+        return self._total_cookies_generated
     
     def get_history(self):
         """
@@ -72,7 +354,33 @@ class ClickerState:
 
         For example: (0.0, None, 0.0, 0.0)
         """
-        return self._history
+        return self._history.get_entries()
+
+    def buy_item_run(self, item_name, cost, additional_cps, growth):
+        """
+        Buy item_name as many times as you can afford, the first one
+        costing cost and each next one growth times more, and record
+        the purchases as one history run.  Same state as that many
+        buy_item calls.
+
+        Returns the cost of the next item_name
+        """
+        # same order of float operations as buy_item so the state is exact
+        first_cost = cost
+        cookies = self._current_cookies
+        cps = self._current_cps
+        count = 0
+        while cookies >= cost:
+            cookies -= cost
+            cps += additional_cps
+            cost *= growth
+            count += 1
+        if count != 0:
+            self._history.append_run(self._current_time, item_name, first_cost, growth,
+                                     count, self._total_cookies_generated)
+        self._current_cookies = cookies
+        self._current_cps = cps
+        return cost
 
     def time_until(self, cookies):
         """
@@ -102,37 +410,222 @@ class ClickerState:
         Buy an item and update state
 
         Should do nothing if you cannot afford the item
+
+        Returns True if the item was bought
         """
         if self._current_cookies >= cost:
             self._current_cookies -= cost
             self._current_cps += additional_cps
             self._history.append((self._current_time, item_name, cost, self._total_cookies_generated))
+            return True
+        return False
    
     
-def simulate_clicker(build_info, duration, strategy):
+class ClickerProfile:
+    """
+    Opt-in instrumentation for simulate_clicker: cumulative time and
+    call count of each phase (strategy, time_until, wait, buy_item,
+    clone) and an optional on_purchase(time, item, cost, total
+    cookies) callback called after each purchase.  With the callback
+    a StrideHistory can replace the full history.
+    """
+    PHASES = ["clone", "strategy", "time_until", "wait", "buy_item"]
+
+    def __init__(self, on_purchase = None):
+        self._on_purchase = on_purchase
+        self._times = {}
+        self._calls = {}
+        for phase in ClickerProfile.PHASES:
+            self._times[phase] = 0.0
+            self._calls[phase] = 0
+        self._purchases = 0
+        self._total_time = 0.0
+
+    def add(self, phase, seconds):
+        """
+        Record one call of phase that took seconds
+        """
+        self._times[phase] += seconds
+        self._calls[phase] += 1
+
+    def add_total(self, seconds):
+        """
+        Record the total time of one simulation
+        """
+        self._total_time += seconds
+
+    def purchase(self, clicker_state, item, cost):
+        """
+        Count a purchase and call the callback
+        """
+        self._purchases += 1
+        if self._on_purchase != None:
+            self._on_purchase(clicker_state.get_time(), item, cost,
+                              clicker_state.get_total_cookies())
+
+    def get_summary(self):
+        """
+        Return a dictionary phase -> (calls, seconds), with the
+        purchase count and the total time of the simulations
+        """
+        summary = {"purchases": self._purchases, "total": self._total_time}
+        for phase in ClickerProfile.PHASES:
+            summary[phase] = (self._calls[phase], self._times[phase])
+        return summary
+
+    def __str__(self):
+        """
+        Return a human readable report
+        """
+        tmp_str = "Purchases:\t" + str(self._purchases) + "\n"
+        tmp_str += "Total:\t" + str(self._total_time) + " s\n"
+        for phase in ClickerProfile.PHASES:
+            tmp_str += (phase + ":\t" + str(self._calls[phase]) + " calls\t" +
+                        str(self._times[phase]) + " s\t" + 
+                        str(100.0 * self._times[phase] / max(self._total_time, 1e-9)) + " %\n")
+        return tmp_str
+
+class ProfiledClickerState(ClickerState):
+    """
+    ClickerState that times time_until, wait and buy_item into a
+    ClickerProfile and reports its purchases to it
+    """
+
+    def __init__(self, profile, history = None):
+        ClickerState.__init__(self, history)
+        self._profile = profile
+
+    def time_until(self, cookies):
+        """
+        Timed ClickerState.time_until
+        """
+        start = time.time()
+        result = ClickerState.time_until(self, cookies)
+        self._profile.add("time_until", time.time() - start)
+        return result
+
+    def wait(self, time_left):
+        """
+        Timed ClickerState.wait
+        """
+        start = time.time()
+        ClickerState.wait(self, time_left)
+        self._profile.add("wait", time.time() - start)
+
+    def buy_item(self, item_name, cost, additional_cps):
+        """
+        Timed ClickerState.buy_item.  An item it can not afford
+        (rounding) is skipped, such a purchase is neither counted
+        nor reported.
+        """
+        start = time.time()
+        bought = ClickerState.buy_item(self, item_name, cost, additional_cps)
+        self._profile.add("buy_item", time.time() - start)
+        if bought:
+            self._profile.purchase(self, item_name, cost)
+        return bought
+
+def run_clicker(clicker_state, build_info_tmp, duration, strategy):
+    """
+    Loop of simulate_clicker: buy the items picked by the strategy
+    until duration, then wait until duration
+    """
+    while clicker_state.get_time() <= duration:
+        item = strategy(clicker_state.get_cookies(), clicker_state.get_cps(), duration - clicker_state.get_time(), build_info_tmp)
+        if item == None:
+            break
+        cost = build_info_tmp.get_cost(item)
+        time_left = clicker_state.time_until(cost)
+        if clicker_state.get_time() + time_left > duration:
+            break
+        clicker_state.wait(time_left)
+        clicker_state.buy_item(item, cost, build_info_tmp.get_cps(item))
+        build_info_tmp.update_item(item)
+    if clicker_state.get_time() < duration:
+        clicker_state.wait(duration - clicker_state.get_time())
+
+def simulate_clicker(build_info, duration, strategy, history = None, profile = None):
     """
     Function to run a Cookie Clicker game for the given
     duration with the given strategy.  Returns a ClickerState
     object corresponding to game.
+    history is an optional history backend for the ClickerState.
+    profile is an optional ClickerProfile filled in by the run.
     """
-    clicker_state = ClickerState()
+    if profile != None:
+        return simulate_clicker_profiled(build_info, duration, strategy, history, profile)
+    clicker_state = ClickerState(history)
+    run_clicker(clicker_state, build_info.clone(), duration, strategy)
+    return clicker_state
+
+def simulate_clicker_profiled(build_info, duration, strategy, history, profile):
+    """
+    simulate_clicker with every phase timed into profile.  The
+    timers are in ProfiledClickerState and around the strategy, so
+    the plain simulate_clicker runs the same loop without them.
+    """
+    sim_start = time.time()
+    clicker_state = ProfiledClickerState(profile, history)
+    start = time.time()
     build_info_tmp = build_info.clone()
-    item = ""
+    profile.add("clone", time.time() - start)
+
+    def timed_strategy(cookies, cps, time_left, build_info):
+        """
+        Timed strategy
+        """
+        start = time.time()
+        item = strategy(cookies, cps, time_left, build_info)
+        profile.add("strategy", time.time() - start)
+        return item
+
+    run_clicker(clicker_state, build_info_tmp, duration, timed_strategy)
+    profile.add_total(time.time() - sim_start)
+    return clicker_state
+
+def profile_clicker(build_info, duration, strategy, history = None, on_purchase = None):
+    """
+    Run simulate_clicker with a new ClickerProfile and return the
+    ClickerState and the profile
+    """
+    profile = ClickerProfile(on_purchase)
+    clicker_state = simulate_clicker(build_info, duration, strategy, history, profile)
+    return clicker_state, profile
+
+def simulate_clicker_fast(build_info, duration, strategy, history = None):
+    """
+    Same as simulate_clicker, for strategies that always pick the
+    same item (strategies with a fixed_item attribute, see
+    fixed_strategy).  The strategy is never called: after each wait
+    every item that can be afforded is bought by one
+    ClickerState.buy_item_run, and these purchases are kept as one
+    history run instead of one tuple each.
+    Other strategies are run by simulate_clicker.
+    """
+    item = getattr(strategy, "fixed_item", None)
+    if item == None:
+        return simulate_clicker(build_info, duration, strategy, history)
+    build_info_tmp = build_info.clone()
+    cost = build_info_tmp.get_cost(item)
+    additional_cps = build_info_tmp.get_cps(item)
+    build_info_tmp.update_item(item)
+    growth = build_info_tmp.get_cost(item) / cost
+    clicker_state = ClickerState(history)
     while clicker_state.get_time() <= duration:
-        item = strategy(clicker_state.get_cookies(), clicker_state.get_cps(), duration - clicker_state.get_time(), build_info_tmp)
-        if item == None:
-            break
-        time = clicker_state.time_until(build_info_tmp.get_cost(item))
+        time = clicker_state.time_until(cost)
         if clicker_state.get_time() + time > duration:
             break
         clicker_state.wait(time)
-        clicker_state.buy_item(item, build_info_tmp.get_cost(item), build_info_tmp.get_cps(item))
-        build_info_tmp.update_item(item)
+        if clicker_state.get_cookies() < cost:
+            # rounding left us just short, like buy_item we skip it
+            cost *= growth
+            continue
+        # buy everything affordable now
+        cost = clicker_state.buy_item_run(item, cost, additional_cps, growth)
     if clicker_state.get_time() < duration:
         clicker_state.wait(duration - clicker_state.get_time())
     return clicker_state
 
-
 def strategy_cursor(cookies, cps, time_left, build_info):
     """
     Always pick Cursor!
@@ -144,6 +637,8 @@ def strategy_cursor(cookies, cps, time_left, build_info):
     """
     return "Cursor"
 
+strategy_cursor.fixed_item = "Cursor"
+
 def strategy_none(cookies, cps, time_left, build_info):
     """
     Always return None
@@ -153,6 +648,19 @@ def strategy_none(cookies, cps, time_left, build_info):
     """
     return None
 
+def fixed_strategy(item):
+    """
+    Return a strategy that always picks the given item.
+    simulate_clicker_fast recognizes it by its fixed_item attribute.
+    """
+    def strategy_fixed(cookies, cps, time_left, build_info):
+        """
+        Always pick the same item
+        """
+        return item
+    strategy_fixed.fixed_item = item
+    return strategy_fixed
+
 def strategy_cheap(cookies, cps, time_left, build_info):
     """
     return the cheapest item
@@ -224,6 +732,386 @@ def strategy_best(cookies, cps, time_left, build_info):
         return None
     else:
         return item_be
+
+class IndexedBuildInfo:
+    """
+    Wrapper around a BuildInfo that keeps its items sorted by cost
+    and by cps / cost.  update_item moves one entry in each order
+    (a bisect search and a list insert) instead of the strategies
+    rescanning every item on every decision.  Ties are broken by
+    the position in build_items, like the scanning strategies do.
+    """
+    def __init__(self, build_info):
+        self._build_info = build_info
+        self._items = build_info.build_items()
+        self._positions = {}
+        for position in range(len(self._items)):
+            self._positions[self._items[position]] = position
+        self._by_cost = []
+        self._by_ratio = []
+        for item in self._items:
+            self._by_cost.append(self.cost_key(item))
+            self._by_ratio.append(self.ratio_key(item))
+        self._by_cost.sort()
+        self._by_ratio.sort()
+
+    def cost_key(self, item):
+        """
+        Entry of item in the cost order
+        """
+        return (self._build_info.get_cost(item), self._positions[item])
+
+    def ratio_key(self, item):
+        """
+        Entry of item in the cps / cost order, best first
+        """
+        return (-self._build_info.get_cps(item) / self._build_info.get_cost(item), 
+                self._positions[item])
+
+    def build_items(self):
+        """
+        Get a list of buildable items
+        """
+        return self._build_info.build_items()
+
+    def get_cost(self, item):
+        """
+        Get the current cost of an item
+        """
+        return self._build_info.get_cost(item)
+
+    def get_cps(self, item):
+        """
+        Get the current CPS of an item
+        """
+        return self._build_info.get_cps(item)
+
+    def update_item(self, item):
+        """
+        Update the cost of an item and its place in both orders
+        """
+        del self._by_cost[bisect.bisect_left(self._by_cost, self.cost_key(item))]
+        del self._by_ratio[bisect.bisect_left(self._by_ratio, self.ratio_key(item))]
+        self._build_info.update_item(item)
+        bisect.insort(self._by_cost, self.cost_key(item))
+        bisect.insort(self._by_ratio, self.ratio_key(item))
+
+    def clone(self):
+        """
+        Return a clone of this IndexedBuildInfo
+        """
+        return IndexedBuildInfo(self._build_info.clone())
+
+    def cheapest(self):
+        """
+        Return the cheapest item (the first one in build order)
+        """
+        return self._items[self._by_cost[0][1]]
+
+    def most_expensive(self, cookies, cps, time_left):
+        """
+        Return the most expensive item that can be bought within
+        time_left (the first one in build order), or None
+        """
+        bound = cookies + cps * math.floor(time_left)
+        pos = bisect.bisect_left(self._by_cost, (bound,))
+        # the bound is only a guess near the edge because of the
+        # rounding in time_to_wait, fix it up with the exact test
+        while pos < len(self._by_cost) and time_to_wait(cookies, cps, self._by_cost[pos][0]) <= time_left:
+            pos += 1
+        while pos > 0 and time_to_wait(cookies, cps, self._by_cost[pos - 1][0]) > time_left:
+            pos -= 1
+        if pos == 0:
+            return None
+        first = bisect.bisect_left(self._by_cost, (self._by_cost[pos - 1][0],))
+        return self._items[self._by_cost[first][1]]
+
+    def items_by_ratio(self):
+        """
+        Generate the items from the best cps / cost to the worst
+        """
+        for entry in self._by_ratio:
+            yield self._items[entry[1]]
+
+def strategy_cheap_indexed(cookies, cps, time_left, build_info):
+    """
+    return the cheapest item, build_info is an IndexedBuildInfo
+    """
+    item_ch = build_info.cheapest()
+    # same test as strategy_cheap, which waits from a fresh ClickerState
+    if time_to_wait(0.0, 1.0, build_info.get_cost(item_ch)) > time_left:
+        return None
+    else:
+        return item_ch
+
+def strategy_expensive_indexed(cookies, cps, time_left, build_info):
+    """
+    return the most expensive item, build_info is an IndexedBuildInfo
+    """
+    return build_info.most_expensive(cookies, cps, time_left)
+
+def strategy_best_indexed(cookies, cps, time_left, build_info):
+    """
+    return the best item, build_info is an IndexedBuildInfo.
+    Walks the cps / cost order until the first item with a wait
+    under time_left.
+    """
+    item_be = None
+    for item in build_info.items_by_ratio():
+        if time_to_wait(cookies, cps, build_info.get_cost(item)) < time_left:
+            item_be = item
+            break
+    # strategy_best starts from the first item in build order with a
+    # wait of at most time_left and only leaves it for a strictly
+    # better ratio.  That first item can only be missed by the walk
+    # when its wait is exactly time_left, so the build order is only
+    # scanned when the most expensive affordable item waits that long.
+    item_ex = build_info.most_expensive(cookies, cps, time_left)
+    if item_ex == None or time_to_wait(cookies, cps, build_info.get_cost(item_ex)) < time_left:
+        return item_be
+    for item in build_info.build_items():
+        if time_to_wait(cookies, cps, build_info.get_cost(item)) <= time_left:
+            break
+    if (item_be != None and build_info.get_cps(item_be) / build_info.get_cost(item_be) >
+        build_info.get_cps(item) / build_info.get_cost(item)):
+        return item_be
+    return item
+
+class PlanTimeout(Exception):
+    """
+    Raised inside the lookahead search when the time or node budget
+    runs out.
+    """
+    pass
+
+class LookaheadStrategy:
+    """
+    Strategy that searches up to max_depth purchases ahead and picks
+    the first purchase of the plan that makes the most cookies over
+    a window of horizon cps growth times.  The plans are finished
+    with greedy cps / cost purchases (see rollout), so the greedy
+    plan is one of the candidates.  Each node keeps only the
+    beam_width most promising purchases, the search deepens one
+    purchase at a time until time_limit seconds are spent on the
+    decision or max_nodes nodes are expanded, and states are
+    memoized on (cookie bucket, time bucket, cps, item counts).
+    With time_limit None the choices only depend on the game, so
+    simulations are reproducible.
+    Use it like any other strategy:
+    simulate_clicker(build_info, duration, LookaheadStrategy())
+    """
+    def __init__(self, max_depth = 3, beam_width = 4, time_limit = 0.01,
+                 horizon = 2.0, resolution = 100.0, max_nodes = None):
+        self._max_depth = max_depth
+        self._horizon = horizon
+        self._beam_width = beam_width
+        self._time_limit = time_limit
+        self._max_nodes = max_nodes
+        self._resolution = resolution
+        self._memo = {}
+        self._deadline = None
+        self._nodes_left = None
+        self.decisions = 0
+        self.nodes_expanded = 0
+        self.cache_lookups = 0
+        self.cache_hits = 0
+
+    def __call__(self, cookies, cps, time_left, build_info):
+        """
+        Pick the next item, same signature as the other strategies
+        """
+        self.decisions += 1
+        self._items = build_info.build_items()
+        self._cps = [build_info.get_cps(item) for item in self._items]
+        costs = [build_info.get_cost(item) for item in self._items]
+        # costs grow geometrically, measure the growth on a clone
+        next_info = build_info.clone()
+        self._growth = []
+        for index in range(len(self._items)):
+            next_info.update_item(self._items[index])
+            self._growth.append(next_info.get_cost(self._items[index]) / costs[index])
+        counts = tuple([0] * len(self._items))
+        # cps grows about rate * cps per second when every cookie is
+        # reinvested in the best item, plans are compared on a window
+        # of a few of these growth times
+        rate = max([self._cps[index] / costs[index] for index in range(len(self._items))])
+        horizon = min(time_left, self._horizon / rate)
+        # the memo is relative to this decision's costs
+        self._memo = {}
+        self._deadline = None
+        if self._time_limit != None:
+            self._deadline = time.time() + self._time_limit
+        self._nodes_left = self._max_nodes
+        best_item = None
+        for depth in range(1, self._max_depth + 1):
+            try:
+                dummy_value, item = self.search(cookies, cps, horizon, costs, counts, depth)
+            except PlanTimeout:
+                break
+            best_item = item
+        if best_item == None:
+            # out of budget before depth 1, fall back to greedy
+            return strategy_best(cookies, cps, time_left, build_info)
+        return best_item
+
+    def bucket(self, amount):
+        """
+        Log-scale bucket of a cookie amount or a time
+        """
+        return int(math.log(amount + 1.0) * self._resolution)
+
+    def search(self, cookies, cps, time_left, costs, counts, depth):
+        """
+        Return (estimated cookies generated in time_left, first item
+        of the plan) for the best plan of at most depth purchases
+        followed by the greedy rollout
+        """
+        self.nodes_expanded += 1
+        # every node runs a rollout, so the clock is cheap in comparison
+        if self._deadline != None and time.time() > self._deadline:
+            raise PlanTimeout()
+        if self._nodes_left != None:
+            if self._nodes_left <= 0:
+                raise PlanTimeout()
+            self._nodes_left -= 1
+        key = (self.bucket(cookies), self.bucket(time_left), cps, counts, depth)
+        self.cache_lookups += 1
+        if key in self._memo:
+            self.cache_hits += 1
+            return self._memo[key]
+        best_value = self.rollout(cookies, cps, time_left, costs)
+        best_item = None
+        if depth > 0:
+            # rank the purchases by their rollout, search the best ones
+            children = []
+            for index in range(len(self._items)):
+                wait = time_to_wait(cookies, cps, costs[index])
+                if wait < time_left:
+                    new_costs = list(costs)
+                    new_costs[index] *= self._growth[index]
+                    child = (cookies + cps * wait - costs[index], cps + self._cps[index],
+                             time_left - wait, new_costs,
+                             counts[:index] + (counts[index] + 1,) + counts[index + 1:])
+                    value = cps * wait + self.search(*(child + (0,)))[0]
+                    children.append((value, index, wait, child))
+            children.sort(reverse = True)
+            for value, index, wait, child in children[:self._beam_width]:
+                if depth > 1:
+                    value = cps * wait + self.search(*(child + (depth - 1,)))[0]
+                if value > best_value or best_item == None:
+                    best_value = value
+                    best_item = self._items[index]
+        self._memo[key] = (best_value, best_item)
+        return best_value, best_item
+
+    def rollout(self, cookies, cps, time_left, costs):
+        """
+        Cookies generated in time_left buying the best cps / cost
+        item that is affordable in time, as strategy_best does
+        """
+        costs = list(costs)
+        total = 0.0
+        while True:
+            best_index = None
+            for index in range(len(costs)):
+                if (best_index == None or self._cps[index] * costs[best_index] > 
+                    self._cps[best_index] * costs[index]):
+                    if time_to_wait(cookies, cps, costs[index]) < time_left:
+                        best_index = index
+            if best_index == None:
+                return total + cps * time_left
+            wait = time_to_wait(cookies, cps, costs[best_index])
+            total += cps * wait
+            time_left -= wait
+            cookies += cps * wait - costs[best_index]
+            cps += self._cps[best_index]
+            costs[best_index] *= self._growth[best_index]
+
+    def hit_rate(self):
+        """
+        Fraction of the memo lookups that were hits
+        """
+        if self.cache_lookups == 0:
+            return 0.0
+        return float(self.cache_hits) / self.cache_lookups
+
+    def __str__(self):
+        """
+        Search statistics
+        """
+        return ("decisions: " + str(self.decisions) +
+                " nodes expanded: " + str(self.nodes_expanded) +
+                " cache hit rate: " + str(self.hit_rate()))
+
+def make_synthetic_build_info(num_items, seed = None, num_costs = None):
+    """
+    Return a BuildInfo with num_items random items, costs spread
+    over ten orders of magnitude.  With num_costs the costs are
+    picked among num_costs values, so many items cost the same.
+    """
+    rand = random.Random(seed)
+    costs = None
+    if num_costs != None:
+        costs = [10.0 ** rand.uniform(1.0, 11.0) for dummy_cost in range(num_costs)]
+    info = {}
+    for index in range(num_items):
+        if costs == None:
+            cost = 10.0 ** rand.uniform(1.0, 11.0)
+        else:
+            cost = rand.choice(costs)
+        info["Item " + str(index)] = [cost, cost * rand.uniform(0.0002, 0.01)]
+    return provided.BuildInfo(info)
+
+def run_strategy_benchmark(num_items = 5000, decisions = 100, seed = 0):
+    """
+    Compare the decisions per second of the scanning strategies
+    and of the IndexedBuildInfo ones on a synthetic catalog.
+    Every decision buys the chosen item, so the index is updated
+    as it would be in simulate_clicker.
+    """
+    build_info = make_synthetic_build_info(num_items, seed)
+    pairs = [("Cheap", strategy_cheap, strategy_cheap_indexed),
+             ("Expensive", strategy_expensive, strategy_expensive_indexed),
+             ("Best", strategy_best, strategy_best_indexed)]
+    for name, strategy, strategy_indexed in pairs:
+        for label, strategy_fn, info in [("scan", strategy, build_info.clone()),
+                                         ("indexed", strategy_indexed,
+                                          IndexedBuildInfo(build_info.clone()))]:
+            rand = random.Random(seed)
+            start = time.time()
+            for dummy_decision in range(decisions):
+                cookies = 10.0 ** rand.uniform(0.0, 9.0)
+                item = strategy_fn(cookies, cookies * 0.01, 10.0 ** rand.uniform(1.0, 4.0), info)
+                if item != None:
+                    info.update_item(item)
+            elapsed = time.time() - start
+            print name, label, ":", int(decisions / max(elapsed, 1e-9)), "decisions/sec"
+
+#run_strategy_benchmark()
+
+def check_indexed_strategies(num_items = 50, num_catalogs = 10, durations = (1e6, 1e8, 1e10)):
+    """
+    Run each scanning strategy and its IndexedBuildInfo version on
+    synthetic catalogs, half of them with tied costs, and compare the
+    histories.  Returns the list of (name, seed, duration) that differ.
+    """
+    pairs = [("Cheap", strategy_cheap, strategy_cheap_indexed),
+             ("Expensive", strategy_expensive, strategy_expensive_indexed),
+             ("Best", strategy_best, strategy_best_indexed)]
+    mismatches = []
+    for seed in range(num_catalogs):
+        num_costs = None
+        if seed % 2 == 1:
+            num_costs = max(1, num_items // 5)
+        build_info = make_synthetic_build_info(num_items, seed, num_costs)
+        for name, strategy, strategy_indexed in pairs:
+            for duration in durations:
+                state = simulate_clicker(build_info, duration, strategy)
+                state_indexed = simulate_clicker(IndexedBuildInfo(build_info.clone()), 
+                                                 duration, strategy_indexed)
+                if state.get_history() != state_indexed.get_history():
+                    mismatches.append((name, seed, duration))
+    return mismatches
         
 def run_strategy(strategy_name, time, strategy):
     """
@@ -236,9 +1124,10 @@ def run_strategy(strategy_name, time, strategy):
 
     # Uncomment out the lines below to see a plot of total cookies vs. time
     # Be sure to allow popups, if you do want to see it
-    history = state.get_history()
-    history = [(item[0], item[3]) for item in history]
-    simpleplot.plot_lines(strategy_name, 1000, 500, 'Time', 'Total Cookies', [history], True)
+    if simpleplot != None:
+        history = state.get_history()
+        history = [(item[0], item[3]) for item in history]
+        simpleplot.plot_lines(strategy_name, 1000, 500, 'Time', 'Total Cookies', [history], True)
 
 def run():
     """
@@ -249,6 +1138,106 @@ def run():
     run_strategy("Cheap", SIM_TIME, strategy_cheap)
     run_strategy("Expensive", SIM_TIME, strategy_expensive)
     run_strategy("Best", SIM_TIME, strategy_best)
-    
-run()
+    #run_strategy("Lookahead", SIM_TIME, LookaheadStrategy())
+
+# nodes the tournament lookahead may expand per decision
+TOURNAMENT_LOOKAHEAD_NODES = 25
+
+def make_tournament_lookahead():
+    """
+    Lookahead strategy for the tournament: the search is bounded by
+    a node budget instead of the clock so the results reproduce
+    """
+    return LookaheadStrategy(time_limit = None, max_nodes = TOURNAMENT_LOOKAHEAD_NODES)
+
+# Strategies the tournament runner can use, by name.  The values
+# make the strategy, so stateful strategies start fresh for each
+# simulation.
+TOURNAMENT_STRATEGIES = {"Cursor": lambda: strategy_cursor,
+                         "Cheap": lambda: strategy_cheap,
+                         "Expensive": lambda: strategy_expensive,
+                         "Best": lambda: strategy_best,
+                         "Lookahead": make_tournament_lookahead}
+
+def tournament_worker(task):
+    """
+    Run one (strategy name, duration, build name, build info)
+    simulation and return its result row
+    """
+    strategy_name, duration, build_name, build_info = task
+    history = StrideHistory(2)
+    start = time.time()
+    state = simulate_clicker(build_info, duration, 
+                             TOURNAMENT_STRATEGIES[strategy_name](), history)
+    elapsed = time.time() - start
+    return {"strategy": strategy_name,
+            "duration": duration,
+            "build": build_name,
+            "total_cookies": state.get_total_cookies(),
+            "cookies": state.get_cookies(),
+            "cps": state.get_cps(),
+            "purchases": history.get_count() - 1,
+            "seconds": elapsed}
+
+def run_tournament(strategy_names, durations, build_infos, num_workers = None):
+    """
+    Run every (strategy, duration, build info) combination across a
+    process pool.  build_infos is a dictionary name -> BuildInfo.
+    The strategies are simulated deterministically and the rows come
+    back in task order, so the results only differ in timings.
+    Returns the list of result rows and the wall-clock time.
+    """
+    if multiprocessing == None:
+        raise ImportError("run_tournament needs multiprocessing")
+    tasks = []
+    for strategy_name in strategy_names:
+        for duration in durations:
+            for build_name in sorted(build_infos):
+                tasks.append((strategy_name, duration, build_name, 
+                              build_infos[build_name]))
+    start = time.time()
+    pool = multiprocessing.Pool(num_workers)
+    try:
+        results = pool.map(tournament_worker, tasks)
+    finally:
+        pool.close()
+        pool.join()
+    return results, time.time() - start
+
+TOURNAMENT_COLUMNS = ["strategy", "duration", "build", "total_cookies",
+                      "cookies", "cps", "purchases", "seconds"]
+
+def write_tournament(results, wall_time, filename):
+    """
+    Write the tournament results to a .csv file (one row per
+    simulation, the wall-clock time of the whole tournament in a
+    last "wall_time" column) or to a .json file (rows and
+    wall-clock time)
+    """
+    out_file = open(filename, "w")
+    try:
+        if filename.endswith(".csv"):
+            writer = csv.writer(out_file)
+            writer.writerow(TOURNAMENT_COLUMNS + ["wall_time"])
+            for row in results:
+                writer.writerow([row[column] for column in TOURNAMENT_COLUMNS] + [wall_time])
+        else:
+            json.dump({"wall_time": wall_time, "results": results},
+                      out_file, indent = 1, sort_keys = True)
+    finally:
+        out_file.close()
+
+def run_example_tournament(filename = "tournament.csv"):
+    """
+    Run the strategies on a few durations and cost growths
+    """
+    build_infos = {"growth 1.15": provided.BuildInfo(),
+                   "growth 1.1": provided.BuildInfo(None, 1.1)}
+    results, wall_time = run_tournament(["Cheap", "Expensive", "Best"],
+                                        [1e6, 1e8, SIM_TIME], build_infos)
+    write_tournament(results, wall_time, filename)
+    print "Tournament of", len(results), "simulations in", wall_time, "seconds"
+
+if __name__ == "__main__":
+    run()
 
@@ -11,8 +11,36 @@ import poc_ttt_gui
 NTRIALS = 10    # Number of trials to run
 MCMATCH = 1.0  # Score for squares played by the machine player
 MCOTHER = 1.0  # Score for squares played by the other player
+
+# Constants for the minimax solver
+MM_MAX_DEPTH = 4    # Search depth for boards larger than 3x3
+MM_TABLE_NAME = "ttt_solved_3x3.bin"    # Solved 3x3 positions, next to this file
+
+# Constants for the MCTS player
+MCTS_EXPLORATION = 1.4    # UCT exploration weight
+MCTS_CONFIDENCE = 2.0     # Width of the confidence intervals, in std errors
+MCTS_CHECK_EVERY = 50     # Playouts between two early stop checks
+MCTS_MIN_VISITS = 20      # Visits needed before a move can be ruled out
     
+import copy
+import math
+import os
 import random
+import struct
+import sys
+import time
+
+# multiprocessing is only needed by mc_move_parallel
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+# numpy is only needed by mc_move_batch
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # Constants
 EMPTY = 1
@@ -42,6 +70,64 @@ class TTTBoard:
             # Copy board grid
             self._board = [[board[row][col] for col in range(dim)]
                            for row in range(dim)]
+        self.init_line_counts()
+
+    def init_line_counts(self):
+        """
+        Count the squares of each player on every line, and the
+        number of empty squares, so check_win does not need to scan
+        the board.
+        Lines are indexed as rows, then columns, then both diagonals.
+        """
+        num_lines = 2 * self._dim + 2
+        self._line_counts = {PLAYERX: [0] * num_lines,
+                             PLAYERO: [0] * num_lines}
+        self._num_empty = 0
+        self._winner = None
+        for row in range(self._dim):
+            for col in range(self._dim):
+                if self._board[row][col] == EMPTY:
+                    self._num_empty += 1
+                else:
+                    self.add_to_lines(row, col, self._board[row][col])
+        for line in range(num_lines):
+            for player in (PLAYERX, PLAYERO):
+                if self._winner == None and self._line_counts[player][line] == self._dim:
+                    self._winner = player
+        self.update_winner(self._winner)
+
+    def add_to_lines(self, row, col, player):
+        """
+        Count square (row, col) for player on its lines.
+        Returns True if one of these lines is now full.
+        """
+        counts = self._line_counts[player]
+        full = False
+        lines = [row, self._dim + col]
+        if row == col:
+            lines.append(2 * self._dim)
+        if row + col == self._dim - 1:
+            lines.append(2 * self._dim + 1)
+        for line in lines:
+            counts[line] += 1
+            if counts[line] == self._dim:
+                full = True
+        return full
+
+    def update_winner(self, player):
+        """
+        Set the cached result of check_win, player being the owner
+        of a full line (or None).
+        """
+        if player != None:
+            if self._reverse:
+                self._winner = switch_player(player)
+            else:
+                self._winner = player
+        elif self._num_empty == 0:
+            self._winner = DRAW
+        else:
+            self._winner = None
 
     def __str__(self):
         """
@@ -66,6 +152,12 @@ class TTTBoard:
         """
         return self._dim
 
+    def is_reverse(self):
+        """
+        Return True if the game is misere (three in a row loses).
+        """
+        return self._reverse
+
     def square(self, row, col):
         """
         Return the status (EMPTY, PLAYERX, PLAYERO) of the square at
@@ -92,6 +184,13 @@ class TTTBoard:
         """
         if self._board[row][col] == EMPTY:
             self._board[row][col] = player
+            self._num_empty -= 1
+            full = self.add_to_lines(row, col, player)
+            if self._winner == None:
+                if full:
+                    self.update_winner(player)
+                else:
+                    self.update_winner(None)
 
     def check_win(self):
         """
@@ -99,43 +198,160 @@ class TTTBoard:
         If game is a draw, return DRAW.
         If game is in progress, return None.
         """
+        return self._winner
+
+    def clone(self):
+        """
+        Return a copy of the board.
+        """
+        board = copy.copy(self)
+        board._board = [row[:] for row in self._board]
+        board._line_counts = {PLAYERX: self._line_counts[PLAYERX][:],
+                              PLAYERO: self._line_counts[PLAYERO][:]}
+        return board
+
+
+# Lines of each square for the flat board, indexed by dim
+SQUARE_LINES = {}
+
+def square_lines(dim):
+    """
+    Return, for every square index of a flat dim x dim board, the
+    tuple of lines (rows, then columns, then diagonals) it is on.
+    """
+    if dim not in SQUARE_LINES:
         lines = []
+        for index in range(dim * dim):
+            row, col = divmod(index, dim)
+            square = [row, dim + col]
+            if row == col:
+                square.append(2 * dim)
+            if row + col == dim - 1:
+                square.append(2 * dim + 1)
+            lines.append(tuple(square))
+        SQUARE_LINES[dim] = lines
+    return SQUARE_LINES[dim]
 
-        # rows
-        lines.extend(self._board)
 
-        # cols
-        cols = [[self._board[rowidx][colidx] for rowidx in range(self._dim)]
-                for colidx in range(self._dim)]
-        lines.extend(cols)
+class TTTFlatBoard:
+    """
+    Tic-Tac-Toe board stored in a flat bytearray, square (row, col)
+    being at index row * dim + col.  Same interface as TTTBoard, and
+    cloning is a copy of the buffer and of the line counters.
+    """
 
-        # diags
-        diag1 = [self._board[idx][idx] for idx in range(self._dim)]
-        diag2 = [self._board[idx][self._dim - idx - 1]
-                 for idx in range(self._dim)]
-        lines.append(diag1)
-        lines.append(diag2)
+    def __init__(self, dim, reverse = False, board = None):
+        self._dim = dim
+        self._reverse = reverse
+        self._lines = square_lines(dim)
+        num_lines = 2 * dim + 2
+        self._line_counts = {PLAYERX: [0] * num_lines,
+                             PLAYERO: [0] * num_lines}
+        self._num_empty = dim * dim
+        self._winner = None
+        self._cells = bytearray([EMPTY]) * (dim * dim)
+        if board != None:
+            for row in range(dim):
+                for col in range(dim):
+                    if board[row][col] != EMPTY:
+                        self.move(row, col, board[row][col])
 
-        # check all lines
-        for line in lines:
-            if len(set(line)) == 1 and line[0] != EMPTY:
+    def __str__(self):
+        """
+        Human readable representation of the board.
+        """
+        return str(TTTBoard(self._dim, self._reverse, self.get_rows()))
+
+    def get_dim(self):
+        """
+        Return the dimension of the board.
+        """
+        return self._dim
+
+    def is_reverse(self):
+        """
+        Return True if the game is misere (three in a row loses).
+        """
+        return self._reverse
+
+    def get_rows(self):
+        """
+        Return the board as a list of rows.
+        """
+        return [list(self._cells[row * self._dim:(row + 1) * self._dim])
+                for row in range(self._dim)]
+
+    def square(self, row, col):
+        """
+        Return the status (EMPTY, PLAYERX, PLAYERO) of the square at
+        position (row, col).
+        """
+        return self._cells[row * self._dim + col]
+
+    def square_index(self, index):
+        """
+        Return the status of the square at the given flat index.
+        """
+        return self._cells[index]
+
+    def get_empty_squares(self):
+        """
+        Return a list of (row, col) tuples for all empty squares
+        """
+        return [divmod(index, self._dim) 
+                for index in range(len(self._cells))
+                if self._cells[index] == EMPTY]
+
+    def move(self, row, col, player):
+        """
+        Place player on the board at position (row, col).
+
+        Does nothing if board square is not empty.
+        """
+        self.move_index(row * self._dim + col, player)
+
+    def move_index(self, index, player):
+        """
+        Place player on the board at the given flat index.
+
+        Does nothing if board square is not empty.
+        """
+        if self._cells[index] != EMPTY:
+            return
+        self._cells[index] = player
+        self._num_empty -= 1
+        counts = self._line_counts[player]
+        full = False
+        for line in self._lines[index]:
+            counts[line] += 1
+            if counts[line] == self._dim:
+                full = True
+        if self._winner == None:
+            if full:
                 if self._reverse:
-                    return switch_player(line[0])
+                    self._winner = switch_player(player)
                 else:
-                    return line[0]
-
-        # no winner, check for draw
-        if len(self.get_empty_squares()) == 0:
-            return DRAW
+                    self._winner = player
+            elif self._num_empty == 0:
+                self._winner = DRAW
 
-        # game is still in progress
-        return None
+    def check_win(self):
+        """
+        If someone has won, return player.
+        If game is a draw, return DRAW.
+        If game is in progress, return None.
+        """
+        return self._winner
 
     def clone(self):
         """
         Return a copy of the board.
         """
-        return TTTBoard(self._dim, self._reverse, self._board)
+        board = copy.copy(self)
+        board._cells = self._cells[:]
+        board._line_counts = {PLAYERX: self._line_counts[PLAYERX][:],
+                              PLAYERO: self._line_counts[PLAYERO][:]}
+        return board
 
 
 def switch_player(player):
@@ -150,12 +366,13 @@ def switch_player(player):
         return PLAYERX
 
 
-def play_game(mc_move_function, ntrials, reverse = False):
+def play_game(mc_move_function, ntrials, reverse = False, board_class = TTTBoard):
     """
     Function to play a game with two MC players.
+    board_class can be TTTBoard or TTTFlatBoard.
     """
     # Setup game
-    board = TTTBoard(3, reverse)
+    board = board_class(3, reverse)
     curplayer = PLAYERX
     winner = None
 
@@ -252,6 +469,628 @@ def mc_move(board, player, trials):
 
 #play_game(mc_move, 200)
 
+def mc_trials_worker(task):
+    """
+    Run a shard of trials with its own seed and return the
+    partial score grid
+    """
+    board, player, trials, seed = task
+    state = random.getstate()
+    random.seed(seed)
+    scores = [[0 for dummy_col in range(board.get_dim())]
+                        for dummy_row in range(board.get_dim())]
+    for dummy_index in range(trials):
+        board_tmp = board.clone()
+        mc_trial(board_tmp, player)
+        mc_update_scores(scores, board_tmp, player)
+    random.setstate(state)
+    return scores
+
+def mc_move_parallel(board, player, trials, num_workers = None, seed = None, pool = None):
+    """
+    Same as mc_move, but the trials are split into shards that run
+    in a multiprocessing pool.  Each shard has its own seed derived
+    from seed, so a given seed and number of workers always gives
+    the same move.  An existing pool can be passed to avoid starting
+    processes on every move.
+    """
+    if num_workers == None:
+        if multiprocessing != None:
+            num_workers = multiprocessing.cpu_count()
+        else:
+            num_workers = 1
+    if seed == None:
+        seed = random.randint(0, 2 ** 30)
+    tasks = []
+    for index in range(num_workers):
+        shard_trials = trials // num_workers
+        if index < trials % num_workers:
+            shard_trials += 1
+        if shard_trials > 0:
+            tasks.append((board, player, shard_trials, seed + index))
+    if pool != None:
+        partial_scores = pool.map(mc_trials_worker, tasks)
+    elif multiprocessing != None and len(tasks) > 1:
+        own_pool = multiprocessing.Pool(num_workers)
+        try:
+            partial_scores = own_pool.map(mc_trials_worker, tasks)
+        finally:
+            own_pool.close()
+            own_pool.join()
+    else:
+        partial_scores = [mc_trials_worker(task) for task in tasks]
+    scores = [[0 for dummy_col in range(board.get_dim())]
+                        for dummy_row in range(board.get_dim())]
+    for partial in partial_scores:
+        for row in range(board.get_dim()):
+            for col in range(board.get_dim()):
+                scores[row][col] += partial[row][col]
+    return get_best_move(board, scores)
+
+def mc_batch_playouts(board, player, trials, rand):
+    """
+    Run trials random playouts at once.  Each playout is a row of
+    a numpy array holding the flattened final board.
+    Returns the (trials, dim * dim) array of final boards and the
+    array of winners (player, other player or DRAW).
+    """
+    dim = board.get_dim()
+    other = switch_player(player)
+    cells = numpy.array(board_cells(board), dtype = numpy.int8)
+    empty = numpy.nonzero(cells == EMPTY)[0]
+    lines = numpy.array(board_lines(dim))
+    # a random order of the empty squares for every playout,
+    # player plays the even turns and other the odd ones
+    order = numpy.argsort(rand.random_sample((trials, len(empty))), axis = 1)
+    times = numpy.full((trials, dim * dim), -1, dtype = numpy.int32)
+    times[:, empty] = numpy.argsort(order, axis = 1)
+    owners = numpy.tile(cells, (trials, 1))
+    owners[:, empty] = numpy.where(times[:, empty] % 2 == 0, player, other)
+    # the game ends when the first line is completed
+    line_owners = owners[:, lines]
+    complete = (line_owners == line_owners[:, :, :1]).all(axis = 2)
+    complete_time = numpy.where(complete, times[:, lines].max(axis = 2), dim * dim)
+    first_line = complete_time.argmin(axis = 1)
+    end_time = complete_time[numpy.arange(trials), first_line]
+    winners = line_owners[numpy.arange(trials), first_line, 0].astype(numpy.int32)
+    winners[end_time == dim * dim] = DRAW
+    if board.is_reverse():
+        winners = numpy.where(winners == player, other,
+                              numpy.where(winners == other, player, winners))
+    owners[times > end_time[:, numpy.newaxis]] = EMPTY
+    return owners, winners
+
+def mc_batch_update_scores(scores, owners, winners, player):
+    """
+    Add the scores of a batch of playouts to the score grid:
+    when player wins its squares get MCMATCH and the other player's
+    squares lose MCOTHER, and the other way round when player loses.
+    """
+    dim = len(scores)
+    other = switch_player(player)
+    sign = numpy.where(winners == player, 1.0, 
+                       numpy.where(winners == other, -1.0, 0.0))
+    square_scores = (MCMATCH * (owners == player) - 
+                     MCOTHER * (owners == other))
+    total = sign.dot(square_scores).reshape(dim, dim)
+    for row in range(dim):
+        for col in range(dim):
+            scores[row][col] += total[row][col]
+
+def mc_move_batch(board, player, trials, seed = None, batch_size = 100000):
+    """
+    Same as mc_move, but the playouts are run and scored with numpy,
+    batch_size playouts at a time.
+    """
+    if numpy == None:
+        raise ImportError("mc_move_batch needs numpy")
+    rand = numpy.random.RandomState(seed)
+    scores = [[0.0 for dummy_col in range(board.get_dim())]
+                        for dummy_row in range(board.get_dim())]
+    if board.check_win() == None:
+        done = 0
+        while done < trials:
+            size = min(batch_size, trials - done)
+            owners, winners = mc_batch_playouts(board, player, size, rand)
+            mc_batch_update_scores(scores, owners, winners, player)
+            done += size
+    return get_best_move(board, scores)
+
+
+class MCTSNode:
+    """
+    Node of the Monte Carlo search tree.  The value of a node is
+    the sum of the playout results for the player who moved into it.
+    """
+
+    def __init__(self, board, player, parent = None, move = None):
+        self.board = board
+        self.player = player
+        self.parent = parent
+        self.move = move
+        self.children = []
+        if board.check_win() == None:
+            self.untried = board.get_empty_squares()
+        else:
+            self.untried = []
+        self.visits = 0
+        self.value = 0.0
+        self.value_sq = 0.0
+
+    def uct_child(self, exploration):
+        """
+        Return the child with the highest upper confidence bound
+        """
+        log_visits = math.log(self.visits)
+        best = None
+        best_score = float("-inf")
+        for child in self.children:
+            score = (child.value / child.visits +
+                     exploration * math.sqrt(log_visits / child.visits))
+            if score > best_score:
+                best = child
+                best_score = score
+        return best
+
+    def expand(self):
+        """
+        Add a child for a random untried move and return it
+        """
+        move = self.untried.pop(random.randrange(len(self.untried)))
+        board = self.board.clone()
+        board.move(move[0], move[1], self.player)
+        child = MCTSNode(board, switch_player(self.player), self, move)
+        self.children.append(child)
+        return child
+
+    def mean(self):
+        """
+        Return the mean playout result of the node
+        """
+        return self.value / self.visits
+
+    def interval(self, confidence):
+        """
+        Return the (low, high) confidence interval of the mean value
+        """
+        mean = self.mean()
+        variance = max(self.value_sq / self.visits - mean * mean, 0.0)
+        width = confidence * math.sqrt(variance / self.visits)
+        return (mean - width, mean + width)
+
+class MCTSPlayer:
+    """
+    Monte Carlo tree search player (UCT selection, expansion, random
+    playout with mc_trial, backpropagation).  The tree is kept between
+    calls and reused when the new board is found in it, and the search
+    stops early once the best move is separated from the others.
+    Can be passed to play_game like mc_move.
+    """
+
+    def __init__(self, exploration = MCTS_EXPLORATION, confidence = MCTS_CONFIDENCE):
+        self.exploration = exploration
+        self.confidence = confidence
+        self.root = None
+        self.playouts = 0
+
+    def __call__(self, board, player, trials):
+        return self.move(board, player, trials)
+
+    def find_root(self, board, player):
+        """
+        Return the node of the kept tree for board and player (looking
+        two moves deep), or a new root if there is none.  The tree is
+        only reused for a game with the same dimension and rules.
+        """
+        if self.root != None and (self.root.board.get_dim() != board.get_dim() or
+                                  self.root.board.is_reverse() != board.is_reverse()):
+            self.root = None
+        if self.root != None:
+            cells = board_cells(board)
+            nodes = [self.root] + self.root.children
+            for child in self.root.children:
+                nodes.extend(child.children)
+            for node in nodes:
+                if node.player == player and board_cells(node.board) == cells:
+                    node.parent = None
+                    return node
+        return MCTSNode(board.clone(), player)
+
+    def separated(self):
+        """
+        Return True if the confidence interval of the best move is
+        above the intervals of all the other moves
+        """
+        if len(self.root.untried) != 0:
+            return False
+        if len(self.root.children) == 1:
+            return True
+        for child in self.root.children:
+            if child.visits < MCTS_MIN_VISITS:
+                return False
+        ranked = sorted(self.root.children, key = MCTSNode.mean)
+        best_low = ranked[-1].interval(self.confidence)[0]
+        for child in ranked[:-1]:
+            if child.interval(self.confidence)[1] >= best_low:
+                return False
+        return True
+
+    def move(self, board, player, trials):
+        """
+        Run up to trials playouts (at least one) and return the move
+        with the best mean result as a (row, column) tuple, or None
+        if the game is over
+        """
+        self.root = self.find_root(board, player)
+        if len(self.root.untried) == 0 and len(self.root.children) == 0:
+            return None
+        self.playouts = 0
+        while self.playouts < max(trials, 1):
+            node = self.root
+            while len(node.untried) == 0 and len(node.children) != 0:
+                node = node.uct_child(self.exploration)
+            if len(node.untried) != 0:
+                node = node.expand()
+            playout = node.board.clone()
+            if playout.check_win() == None:
+                mc_trial(playout, node.player)
+            winner = playout.check_win()
+            self.playouts += 1
+            while node.parent != None:
+                mover = node.parent.player
+                result = 0.0
+                if winner == mover:
+                    result = 1.0
+                elif winner != DRAW:
+                    result = -1.0
+                node.visits += 1
+                node.value += result
+                node.value_sq += result * result
+                node = node.parent
+            node.visits += 1
+            if self.playouts % MCTS_CHECK_EVERY == 0 and self.separated():
+                break
+        # same statistic as the early stop in separated
+        best = max(self.root.children, key = MCTSNode.mean)
+        self.root = best
+        return best.move
+
+MCTS_PLAYER = MCTSPlayer()
+
+def mcts_move(board, player, trials):
+    """
+    Return a move for player using Monte Carlo tree search.
+    The search tree is kept between calls in MCTS_PLAYER.
+    """
+    return MCTS_PLAYER.move(board, player, trials)
+
+
+def board_symmetries(dim):
+    """
+    Return the 8 permutations of flat square indices given by the
+    rotations and reflections of a dim x dim board
+    """
+    symmetries = []
+    for flip in (False, True):
+        for turns in range(4):
+            perm = []
+            for index in range(dim * dim):
+                row, col = divmod(index, dim)
+                if flip:
+                    col = dim - 1 - col
+                for dummy_turn in range(turns):
+                    row, col = col, dim - 1 - row
+                perm.append(row * dim + col)
+            symmetries.append(tuple(perm))
+    return symmetries
+
+def board_lines(dim):
+    """
+    Return the flat square indices of every row, column and diagonal
+    """
+    lines = [tuple(row * dim + col for col in range(dim)) for row in range(dim)]
+    lines.extend(tuple(row * dim + col for row in range(dim)) for col in range(dim))
+    lines.append(tuple(idx * dim + idx for idx in range(dim)))
+    lines.append(tuple(idx * dim + dim - idx - 1 for idx in range(dim)))
+    return lines
+
+class TTTSolver:
+    """
+    Negamax search with alpha-beta pruning for Tic-Tac-Toe.
+    Positions are stored in a transposition table under the smallest
+    of their 8 symmetric versions.  If max_depth is None the game is
+    solved to the end, otherwise leaves are scored by a heuristic.
+    Scores are from the point of view of the player to move: a win
+    is worth more than 1 (more when it comes sooner), a draw 0, and
+    the heuristic stays between -1 and 1.
+    """
+
+    EXACT = 0
+    LOWER = 1
+    UPPER = 2
+
+    def __init__(self, dim, reverse = False, max_depth = None):
+        self._dim = dim
+        self._reverse = reverse
+        self._max_depth = max_depth
+        self._symmetries = board_symmetries(dim)
+        self._lines = board_lines(dim)
+        self._square_lines = [[line for line in self._lines if index in line]
+                              for index in range(dim * dim)]
+        self._table = {}
+        self.nodes = 0
+
+    def canonical_key(self, cells, player):
+        """
+        Return the transposition table key of a position
+        """
+        return (player, min(tuple(cells[index] for index in perm)
+                            for perm in self._symmetries))
+
+    def is_full_line(self, cells, index, player):
+        """
+        Return True if the move of player at index completed a line
+        """
+        for line in self._square_lines[index]:
+            full = True
+            for square in line:
+                if cells[square] != player:
+                    full = False
+                    break
+            if full:
+                return True
+        return False
+
+    def heuristic(self, cells, player):
+        """
+        Score a position by the lines still open to each player
+        """
+        other = switch_player(player)
+        open_lines = 0
+        for line in self._lines:
+            squares = [cells[index] for index in line]
+            if other not in squares:
+                open_lines += 1
+            if player not in squares:
+                open_lines -= 1
+        score = float(open_lines) / (len(self._lines) + 1)
+        if self._reverse:
+            return -score
+        return score
+
+    def move_score(self, cells, index, player, num_empty, depth, alpha, beta):
+        """
+        Score for player of playing at index, num_empty being the
+        number of empty squares before the move
+        """
+        cells[index] = player
+        if self.is_full_line(cells, index, player):
+            score = 1.0 + num_empty
+            if self._reverse:
+                score = -score
+        elif num_empty == 1:
+            score = 0.0
+        else:
+            score = -self.negamax(cells, switch_player(player), num_empty - 1,
+                                  depth - 1, -beta, -alpha)
+        cells[index] = EMPTY
+        return score
+
+    def negamax(self, cells, player, num_empty, depth, alpha, beta):
+        """
+        Score of the position for player, who is to move
+        """
+        self.nodes += 1
+        if depth == 0:
+            return self.heuristic(cells, player)
+        key = self.canonical_key(cells, player)
+        entry = self._table.get(key)
+        if entry != None and entry[0] >= depth:
+            if entry[2] == TTTSolver.EXACT:
+                return entry[1]
+            elif entry[2] == TTTSolver.LOWER:
+                alpha = max(alpha, entry[1])
+            else:
+                beta = min(beta, entry[1])
+            if alpha >= beta:
+                return entry[1]
+        alpha_orig = alpha
+        best = float("-inf")
+        for index in range(len(cells)):
+            if cells[index] != EMPTY:
+                continue
+            score = self.move_score(cells, index, player, num_empty, depth, alpha, beta)
+            best = max(best, score)
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                break
+        if best <= alpha_orig:
+            flag = TTTSolver.UPPER
+        elif best >= beta:
+            flag = TTTSolver.LOWER
+        else:
+            flag = TTTSolver.EXACT
+        self._table[key] = (depth, best, flag)
+        return best
+
+    def best_index(self, cells, player):
+        """
+        Return the flat index of the best move for player
+        """
+        num_empty = cells.count(EMPTY)
+        depth = num_empty
+        if self._max_depth != None:
+            depth = min(depth, self._max_depth)
+        best = None
+        best_score = float("-inf")
+        for index in range(len(cells)):
+            if cells[index] != EMPTY:
+                continue
+            score = self.move_score(cells, index, player, num_empty, depth,
+                                    float("-inf"), float("inf"))
+            if score > best_score:
+                best = index
+                best_score = score
+        return best
+
+    def best_move(self, board, player):
+        """
+        Return the best move for player as a (row, column) tuple
+        """
+        cells = board_cells(board)
+        return divmod(self.best_index(cells, player), self._dim)
+
+def board_cells(board):
+    """
+    Return the squares of a board as a flat list
+    """
+    dim = board.get_dim()
+    return [board.square(row, col) for row in range(dim) for col in range(dim)]
+
+# Solved table file: header (magic, dim) then one byte per
+# (reverse, player, squares) position, at solved_table_index, holding
+# the flat index of the best move or TABLE_NO_MOVE
+TABLE_MAGIC = "TTT1"
+TABLE_HEADER = struct.Struct("<4sB")
+TABLE_NO_MOVE = 255
+MM_TABLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), MM_TABLE_NAME)
+
+# Solved 3x3 positions as read from MM_TABLE_FILE, empty until loaded
+SOLVED_TABLE = bytearray()
+
+def solved_table_index(reverse, player, cells):
+    """
+    Return the position of (reverse, player, cells) in a solved table
+    """
+    index = 2 * int(reverse) + int(player == PLAYERO)
+    for cell in cells:
+        index = index * 3 + cell - EMPTY
+    return index
+
+def build_solved_table(dim = 3):
+    """
+    Solve every position reachable from the empty board, for both
+    players starting and both game types.
+    Returns a dictionary (reverse, player, squares) -> best move index
+    """
+    table = {}
+    for reverse in (False, True):
+        solver = TTTSolver(dim, reverse)
+        for first_player in (PLAYERX, PLAYERO):
+            stack = [([EMPTY] * (dim * dim), first_player)]
+            while len(stack) != 0:
+                cells, player = stack.pop()
+                key = (reverse, player, tuple(cells))
+                if key in table:
+                    continue
+                table[key] = solver.best_index(cells, player)
+                for index in range(len(cells)):
+                    if cells[index] != EMPTY:
+                        continue
+                    cells[index] = player
+                    if (not solver.is_full_line(cells, index, player) and
+                            EMPTY in cells):
+                        stack.append((cells[:], switch_player(player)))
+                    cells[index] = EMPTY
+    return table
+
+def save_solved_table(table, filename = MM_TABLE_FILE, dim = 3):
+    """
+    Write a table made by build_solved_table to disk
+    """
+    moves = bytearray([TABLE_NO_MOVE]) * (4 * 3 ** (dim * dim))
+    for (reverse, player, cells), index in table.items():
+        moves[solved_table_index(reverse, player, cells)] = index
+    out_file = open(filename, "wb")
+    try:
+        out_file.write(TABLE_HEADER.pack(TABLE_MAGIC, dim))
+        out_file.write(moves)
+    finally:
+        out_file.close()
+
+def load_solved_table(filename = MM_TABLE_FILE, dim = 3):
+    """
+    Load a solved table from disk into SOLVED_TABLE
+    """
+    in_file = open(filename, "rb")
+    try:
+        data = in_file.read()
+    finally:
+        in_file.close()
+    size = TABLE_HEADER.size + 4 * 3 ** (dim * dim)
+    if len(data) != size or TABLE_HEADER.unpack_from(data) != (TABLE_MAGIC, dim):
+        raise ValueError(filename + " is not a solved " + str(dim) + "x" + 
+                         str(dim) + " table")
+    SOLVED_TABLE[:] = bytearray(data[TABLE_HEADER.size:])
+
+def write_solved_table(filename = MM_TABLE_FILE):
+    """
+    Solve every 3x3 position and save the table for mm_move.
+    This takes a few seconds, run it once.
+    """
+    save_solved_table(build_solved_table(), filename)
+
+# Solvers kept between moves, indexed by (dim, reverse, max_depth)
+MM_SOLVERS = {}
+
+def mm_move(board, player, dummy_trials = None):
+    """
+    Return the best move for player as a (row, column) tuple, or
+    None if the game is over.
+    3x3 boards are looked up in the solved table when
+    write_solved_table has saved it, it is loaded on the first call.
+    Other boards, and 3x3 boards without the table, are searched by
+    a solver kept between calls, MM_MAX_DEPTH moves ahead for boards
+    larger than 3x3.  The unused last argument lets mm_move be passed
+    to play_game.
+    """
+    if board.check_win() != None:
+        return None
+    dim = board.get_dim()
+    if dim == 3:
+        if len(SOLVED_TABLE) == 0 and os.path.exists(MM_TABLE_FILE):
+            load_solved_table()
+        if len(SOLVED_TABLE) != 0:
+            index = SOLVED_TABLE[solved_table_index(board.is_reverse(), player, 
+                                                    board_cells(board))]
+            if index != TABLE_NO_MOVE:
+                return divmod(index, dim)
+    max_depth = None
+    if dim > 3:
+        max_depth = MM_MAX_DEPTH
+    key = (dim, board.is_reverse(), max_depth)
+    if key not in MM_SOLVERS:
+        MM_SOLVERS[key] = TTTSolver(dim, board.is_reverse(), max_depth)
+    return MM_SOLVERS[key].best_move(board, player)
+
+
+def object_size(obj):
+    """
+    Return the size in bytes of obj and of the lists, tuples and
+    dictionaries it contains
+    """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for value in obj.values():
+            size += object_size(value)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            size += object_size(value)
+    return size
+
+def run_board_benchmark(dim, trials):
+    """
+    Compare the time and memory of TTTBoard and TTTFlatBoard
+    when running Monte Carlo trials
+    """
+    for board_class in (TTTBoard, TTTFlatBoard):
+        board = board_class(dim)
+        # the square lines are shared by all the flat boards
+        size = object_size(dict((key, value) for key, value in board.__dict__.items()
+                                if key != "_lines"))
+        start = time.time()
+        mc_trials_worker((board, PLAYERX, trials, 0))
+        print board_class.__name__, ":", trials / (time.time() - start), "trials/s,", size, "bytes"
 
 
 # Test game with the console or the GUI.
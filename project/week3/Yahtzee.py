@@ -6,6 +6,38 @@ Simplifications:  only allow discard and roll, only score against upper level
 # Used to increase the timeout, if necessary
 #import codeskulptor
 #codeskulptor.set_timeout(1)
+import collections
+import math
+import struct
+import time
+
+# the strategy table file is read through mmap when it is available
+try:
+    import mmap
+except ImportError:
+    mmap = None
+
+# array and multiprocessing are only needed by solve_game
+try:
+    import array
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+# resource is only needed by run_generator_benchmark (Unix only)
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# numpy is only needed by score_batch and the fast path of the solver
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Number of (held dice, sides, free dice) expected values kept
+EV_CACHE_SIZE = 4096
 
 def gen_all_sequences(outcomes, length):
     """
@@ -34,24 +66,110 @@ def score(hand):
 
     Returns an integer score 
     """
-    scores = []
-    sum_score = []
-    contained = 0
+    # sum of the dice of each face
+    sums = {}
     for dice in hand:
-        contained = 0
-        for index in range(len(scores)):
-            if dice == scores[index][0]:
-                scores[index][1] += dice
-                contained = 1
-                break
-        if contained == 0:
-            scores.append([dice, dice])
-    for score_pair in scores:
-        sum_score.append(score_pair[1])
-    return max(sum_score)
+        sums[dice] = sums.get(dice, 0) + dice
+    return max(sums.values())
+
+def score_batch(hands):
+    """
+    Compute score for every row of the 2D numpy array hands at once.
+    Each row is offset into its own block of face sums so that one
+    bincount adds up the dice of every face of every hand.
+
+    Returns a numpy array of integer scores, one per hand
+    """
+    num_hands = hands.shape[0]
+    width = int(hands.max()) + 1
+    blocks = hands + width * numpy.arange(num_hands)[:, numpy.newaxis]
+    sums = numpy.bincount(blocks.ravel(), weights = hands.ravel(),
+                          minlength = num_hands * width)
+    return sums.reshape((num_hands, width)).max(axis = 1).astype(numpy.int64)
+
+def iter_sorted_outcomes(num_die_sides, num_free_dice):
+    """
+    Generate the unordered rolls of num_free_dice dice, each with
+    num_die_sides, one at a time and in lexicographic order.
+
+    Yields (sorted tuple of dice, number of ordered sequences giving
+    that roll) pairs, the counts add up to
+    num_die_sides ** num_free_dice
+    """
+    roll = [1] * num_free_dice
+    while True:
+        # multinomial coefficient num_free_dice! / prod(count!)
+        count = math.factorial(num_free_dice)
+        for dice in set(roll):
+            count //= math.factorial(roll.count(dice))
+        yield tuple(roll), count
+        # the next sorted roll: bump the last die that can go up
+        # and copy it to the dice after it
+        index = num_free_dice - 1
+        while index >= 0 and roll[index] == num_die_sides:
+            index -= 1
+        if index < 0:
+            return
+        roll[index] += 1
+        for position in range(index + 1, num_free_dice):
+            roll[position] = roll[index]
+
+def gen_sorted_outcomes(num_die_sides, num_free_dice):
+    """
+    List of the (sorted roll, count) pairs of iter_sorted_outcomes
+    """
+    return list(iter_sorted_outcomes(num_die_sides, num_free_dice))
+
+class LRUCache:
+    """
+    Dictionary that keeps at most max_size entries, dropping the
+    least recently used one
+    """
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default = None):
+        """
+        Return the value of key and mark it as recently used
+        """
+        if key in self._entries:
+            self.hits += 1
+            value = self._entries.pop(key)
+            self._entries[key] = value
+            return value
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        """
+        Store value for key
+        """
+        if key in self._entries:
+            del self._entries[key]
+        elif len(self._entries) >= self._max_size:
+            self._entries.popitem(last = False)
+        self._entries[key] = value
+
+    def clear(self):
+        """
+        Drop every entry
+        """
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
 
+# Shared by every call to expected_value, and so by strategy
+OUTCOMES_CACHE = {}
+EV_CACHE = LRUCache(EV_CACHE_SIZE)
 
-def expected_value(held_dice, num_die_sides, num_free_dice):
+# (sides, free dice) -> (array of the sorted rolls, array of counts)
+OUTCOMES_ARRAY_CACHE = {}
+
+def expected_value(held_dice, num_die_sides, num_free_dice, vectorized = False):
     """
     Compute the expected value of the held_dice given that there
     are num_free_dice to be rolled, each with num_die_sides.
@@ -59,9 +177,42 @@ def expected_value(held_dice, num_die_sides, num_free_dice):
     held_dice: dice that you will hold
     num_die_sides: number of sides on each die
     num_free_dice: number of dice to be rolled
+    vectorized: score all the rolls with one score_batch call
+    (needs numpy)
 
     Returns a floating point expected value
     """
+    key = (tuple(sorted(held_dice)), num_die_sides, num_free_dice)
+    value = EV_CACHE.get(key)
+    if value != None:
+        return value
+    if (num_die_sides, num_free_dice) not in OUTCOMES_CACHE:
+        OUTCOMES_CACHE[(num_die_sides, num_free_dice)] = gen_sorted_outcomes(num_die_sides, num_free_dice)
+    held = tuple(held_dice)
+    if vectorized:
+        if (num_die_sides, num_free_dice) not in OUTCOMES_ARRAY_CACHE:
+            outcomes = OUTCOMES_CACHE[(num_die_sides, num_free_dice)]
+            OUTCOMES_ARRAY_CACHE[(num_die_sides, num_free_dice)] = (
+                numpy.array([roll for roll, dummy_count in outcomes], dtype = numpy.int64)
+                .reshape((len(outcomes), num_free_dice)),
+                numpy.array([count for dummy_roll, count in outcomes], dtype = numpy.int64))
+        rolls, counts = OUTCOMES_ARRAY_CACHE[(num_die_sides, num_free_dice)]
+        hands = numpy.hstack((numpy.tile(numpy.array(held, dtype = numpy.int64), (len(rolls), 1)), rolls))
+        scores = int(score_batch(hands).dot(counts))
+    else:
+        scores = 0
+        for roll, count in OUTCOMES_CACHE[(num_die_sides, num_free_dice)]:
+            scores += score(held + roll) * count
+    # the sum is exact, so this is the same float as expected_value_seq
+    value = float(scores) / num_die_sides ** num_free_dice
+    EV_CACHE.put(key, value)
+    return value
+
+def expected_value_seq(held_dice, num_die_sides, num_free_dice):
+    """
+    expected_value over every ordered sequence of the free dice,
+    kept as the reference implementation
+    """
     outcomes = [index + 1 for index in range(num_die_sides)]
     length = num_free_dice
     num_of_hands = 0
@@ -106,6 +257,89 @@ def gen_all_holds(hand):
                     holds.append(tuple(tmp_hold[0][:]))
     return set(holds)
 
+def iter_holds(hand):
+    """
+    Generate all possible choices of dice from hand to hold, each
+    one once, from the count of each face of the hand.
+
+    hand: full yahtzee hand
+
+    Yields sorted tuples of dice to hold
+    """
+    histogram = {}
+    for dice in hand:
+        histogram[dice] = histogram.get(dice, 0) + 1
+    faces = sorted(histogram)
+    counts = [histogram[face] for face in faces]
+    # held[index] is how many dice of faces[index] are held, counted
+    # like an odometer whose digits go up to counts[index]
+    held = [0] * len(faces)
+    while True:
+        hold = ()
+        for index in range(len(faces)):
+            hold += (faces[index],) * held[index]
+        yield hold
+        index = 0
+        while index < len(faces) and held[index] == counts[index]:
+            held[index] = 0
+            index += 1
+        if index == len(faces):
+            return
+        held[index] += 1
+
+# Variants compared by run_generator_benchmark, "baseline" does nothing
+GENERATOR_VARIANTS = ["baseline", "gen_all_holds", "iter_holds",
+                      "gen_all_sequences", "iter_sorted_outcomes"]
+
+def generator_benchmark_worker(task):
+    """
+    Pool worker: run one (variant, num_dice, num_die_sides, hand)
+    of run_generator_benchmark and return (number of items, seconds,
+    peak resident size of the process)
+    """
+    variant, num_dice, num_die_sides, hand = task
+    outcomes = [index + 1 for index in range(num_die_sides)]
+    start = time.time()
+    num_items = 0
+    if variant == "gen_all_holds":
+        num_items = len(gen_all_holds(hand))
+    elif variant == "iter_holds":
+        for dummy_hold in iter_holds(hand):
+            num_items += 1
+    elif variant == "gen_all_sequences":
+        num_items = len(gen_all_sequences(outcomes, num_dice))
+    elif variant == "iter_sorted_outcomes":
+        for dummy_roll, count in iter_sorted_outcomes(num_die_sides, num_dice):
+            num_items += count
+    elapsed = time.time() - start
+    return num_items, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_generator_benchmark(num_dice = 7, num_die_sides = 6, hand = range(1, 13)):
+    """
+    Compare the time and peak memory of gen_all_holds against
+    iter_holds on hand, and of gen_all_sequences against
+    iter_sorted_outcomes for num_dice dice with num_die_sides.
+    Each variant runs in a new process, its peak resident size
+    (ru_maxrss, kilobytes on Linux) is printed with the growth over
+    a process that runs nothing.  Holds are counted one per hold,
+    outcomes one per sequence.
+    """
+    if multiprocessing == None or resource == None:
+        raise ImportError("run_generator_benchmark needs multiprocessing and resource")
+    baseline = None
+    for variant in GENERATOR_VARIANTS:
+        pool = multiprocessing.Pool(1)
+        try:
+            num_items, elapsed, peak = pool.apply(generator_benchmark_worker,
+                                                  ((variant, num_dice, num_die_sides, hand),))
+        finally:
+            pool.close()
+            pool.join()
+        if baseline == None:
+            baseline = peak
+        print variant + ":", num_items, "items,", elapsed, "s, peak", peak, 
+        print "KB (+" + str(peak - baseline) + ")"
+
 def strategy(hand, num_die_sides):
     """
     Compute the hold that maximizes the expected value when the
@@ -128,6 +362,407 @@ def strategy(hand, num_die_sides):
     return (max_value, max_value_hold)
 
 
+# Strategy table file: header (magic, sides, hand length, number of
+# hands) then one (expected score, hold mask) record per sorted hand,
+# in the order of gen_sorted_outcomes.  Bit i of the mask holds the
+# i-th die of the sorted hand.
+TABLE_MAGIC = "YST1"
+TABLE_HEADER = struct.Struct("<4sHHI")
+TABLE_RECORD = struct.Struct("<dH")
+
+def hold_mask(sorted_hand, hold):
+    """
+    Return the mask of the dice of sorted_hand to hold
+    """
+    mask = 0
+    used = 0
+    for dice in sorted(hold):
+        while sorted_hand[used] != dice:
+            used += 1
+        mask |= 1 << used
+        used += 1
+    return mask
+
+def build_strategy_table(filename, num_die_sides = 6, hand_length = 5):
+    """
+    Compute strategy for every sorted hand and write the table to
+    filename.  Returns the number of hands.
+    """
+    hands = gen_sorted_outcomes(num_die_sides, hand_length)
+    out_file = open(filename, "wb")
+    try:
+        out_file.write(TABLE_HEADER.pack(TABLE_MAGIC, num_die_sides, hand_length, len(hands)))
+        for hand, dummy_count in hands:
+            value, hold = strategy(hand, num_die_sides)
+            out_file.write(TABLE_RECORD.pack(value, hold_mask(hand, hold)))
+    finally:
+        out_file.close()
+    return len(hands)
+
+class StrategyTable:
+    """
+    Strategy table written by build_strategy_table.  strategy(hand)
+    finds the record of the sorted hand from its rank, without
+    searching, and reads it from the (memory-mapped) file.
+    """
+    def __init__(self, filename):
+        table_file = open(filename, "rb")
+        try:
+            if mmap != None:
+                self._data = mmap.mmap(table_file.fileno(), 0, access = mmap.ACCESS_READ)
+            else:
+                self._data = table_file.read()
+        finally:
+            table_file.close()
+        if len(self._data) < TABLE_HEADER.size:
+            raise ValueError("not a strategy table: " + filename)
+        magic, sides, length, num_hands = TABLE_HEADER.unpack_from(self._data, 0)
+        if magic != TABLE_MAGIC:
+            raise ValueError("not a strategy table: " + filename)
+        if len(self._data) != TABLE_HEADER.size + num_hands * TABLE_RECORD.size:
+            raise ValueError("truncated or corrupt strategy table: " + filename)
+        self._num_die_sides = sides
+        self._hand_length = length
+        self._num_hands = num_hands
+        # offsets[index][dice] is the number of sorted hands that
+        # come before dice at position index, for the same prefix
+        self._offsets = []
+        for index in range(length):
+            free = length - index - 1
+            offsets = [0] * (sides + 2)
+            for dice in range(1, sides + 1):
+                # sorted rolls of the free dice with values in [dice, sides]
+                offsets[dice + 1] = offsets[dice] + (math.factorial(sides - dice + free) //
+                                                     (math.factorial(free) * math.factorial(sides - dice)))
+            self._offsets.append(offsets)
+        if length != 0 and self._offsets[0][sides + 1] != num_hands:
+            raise ValueError("wrong number of hands in strategy table: " + filename)
+
+    def rank(self, sorted_hand):
+        """
+        Return the position of sorted_hand in gen_sorted_outcomes order
+        """
+        position = 0
+        previous = 1
+        for index in range(self._hand_length):
+            offsets = self._offsets[index]
+            position += offsets[sorted_hand[index]] - offsets[previous]
+            previous = sorted_hand[index]
+        return position
+
+    def strategy(self, hand):
+        """
+        Same result as strategy(hand, num_die_sides), with the hold
+        in sorted order
+        """
+        if len(hand) != self._hand_length:
+            raise ValueError("the table is for hands of " + str(self._hand_length) + " dice")
+        sorted_hand = tuple(sorted(hand))
+        value, mask = TABLE_RECORD.unpack_from(self._data, TABLE_HEADER.size + 
+                                               TABLE_RECORD.size * self.rank(sorted_hand))
+        hold = tuple([sorted_hand[index] for index in range(self._hand_length)
+                      if mask & (1 << index)])
+        return (value, hold)
+
+    def close(self):
+        """
+        Release the file mapping
+        """
+        if mmap != None:
+            self._data.close()
+
+def check_strategy_table(table, num_die_sides = 6, hand_length = 5):
+    """
+    Compare the table with strategy on every sorted hand.  Ties can
+    pick different holds, so a hold only has to reach the same
+    expected score.  Returns the list of hands that differ.
+    """
+    mismatches = []
+    for hand, dummy_count in gen_sorted_outcomes(num_die_sides, hand_length):
+        value, hold = strategy(hand, num_die_sides)
+        table_value, table_hold = table.strategy(hand)
+        if (table_value != value or 
+            expected_value(table_hold, num_die_sides, hand_length - len(table_hold)) != value):
+            mismatches.append(hand)
+    return mismatches
+
+# Full Yahtzee turn and game solver (5 dice, 6 sides, 13 categories).
+# Yahtzee bonuses and joker rules are not modelled.
+YAHTZEE_DICE = 5
+YAHTZEE_SIDES = 6
+CATEGORIES = ["Ones", "Twos", "Threes", "Fours", "Fives", "Sixes",
+              "Three of a kind", "Four of a kind", "Full house",
+              "Small straight", "Large straight", "Yahtzee", "Chance"]
+NUM_UPPER = 6
+ALL_CATEGORIES = (1 << len(CATEGORIES)) - 1
+UPPER_BONUS_THRESHOLD = 63
+UPPER_BONUS = 35
+# a game state is open categories mask * UPPER_STATES + upper total
+# (capped at the bonus threshold)
+UPPER_STATES = UPPER_BONUS_THRESHOLD + 1
+
+def category_score(hand, category):
+    """
+    Score of a 5 dice hand in the given category (index in CATEGORIES)
+    """
+    counts = [hand.count(face) for face in range(1, YAHTZEE_SIDES + 1)]
+    if category < NUM_UPPER:
+        return (category + 1) * counts[category]
+    name = CATEGORIES[category]
+    faces = set(hand)
+    if name == "Three of a kind":
+        return sum(hand) if max(counts) >= 3 else 0
+    elif name == "Four of a kind":
+        return sum(hand) if max(counts) >= 4 else 0
+    elif name == "Full house":
+        return 25 if sorted(counts)[-2:] == [2, 3] else 0
+    elif name == "Small straight":
+        for start in range(1, 4):
+            if set(range(start, start + 4)) <= faces:
+                return 30
+        return 0
+    elif name == "Large straight":
+        return 40 if len(faces) == 5 and max(faces) - min(faces) == 4 else 0
+    elif name == "Yahtzee":
+        return 50 if max(counts) == 5 else 0
+    return sum(hand)
+
+class TurnTables:
+    """
+    Everything about a turn that does not depend on the scorecard:
+    the sorted rolls, the holds, the probability of each roll after
+    rerolling the dice outside a hold, the holds of each roll and
+    the category scores of each roll.  Built once, see get_turn_tables.
+    """
+    def __init__(self):
+        self.rolls = [roll for roll, dummy_count in gen_sorted_outcomes(YAHTZEE_SIDES, YAHTZEE_DICE)]
+        self.roll_index = dict([(self.rolls[index], index) for index in range(len(self.rolls))])
+        self.holds = []
+        for size in range(YAHTZEE_DICE + 1):
+            self.holds.extend([hold for hold, dummy_count in gen_sorted_outcomes(YAHTZEE_SIDES, size)])
+        hold_index = dict([(self.holds[index], index) for index in range(len(self.holds))])
+        # transitions[hold] is a list of (roll, probability)
+        self.transitions = []
+        for hold in self.holds:
+            free = YAHTZEE_DICE - len(hold)
+            total = float(YAHTZEE_SIDES ** free)
+            self.transitions.append([(self.roll_index[tuple(sorted(hold + outcome))], count / total)
+                                     for outcome, count in gen_sorted_outcomes(YAHTZEE_SIDES, free)])
+        self.first_roll = [0.0] * len(self.rolls)
+        for roll, probability in self.transitions[hold_index[()]]:
+            self.first_roll[roll] = probability
+        self.roll_holds = [sorted([hold_index[hold] for hold in gen_all_holds(roll)])
+                           for roll in self.rolls]
+        self.scores = [[category_score(roll, category) for category in range(len(CATEGORIES))]
+                       for roll in self.rolls]
+        if numpy != None:
+            self.transition_matrix = numpy.zeros((len(self.holds), len(self.rolls)))
+            for hold in range(len(self.holds)):
+                for roll, probability in self.transitions[hold]:
+                    self.transition_matrix[hold, roll] = probability
+            # pad with the roll's first hold, it does not change the max
+            width = max([len(holds) for holds in self.roll_holds])
+            self.roll_holds_array = numpy.array([holds + [holds[0]] * (width - len(holds))
+                                                 for holds in self.roll_holds])
+            self.score_array = numpy.array(self.scores, dtype = float)
+            self.first_roll_array = numpy.array(self.first_roll)
+
+    def hold_values(self, roll_values):
+        """
+        Expected value of each hold when the next roll is worth
+        roll_values
+        """
+        if numpy != None:
+            return self.transition_matrix.dot(roll_values)
+        return [sum([probability * roll_values[roll] for roll, probability in transition])
+                for transition in self.transitions]
+
+    def reroll_values(self, roll_values):
+        """
+        Value of each roll with one more reroll, when the roll after
+        it is worth roll_values (holding every die keeps the roll)
+        """
+        hold_values = self.hold_values(roll_values)
+        if numpy != None:
+            return hold_values[self.roll_holds_array].max(axis = 1)
+        return [max([hold_values[hold] for hold in holds]) for holds in self.roll_holds]
+
+    def turn_value(self, final_values):
+        """
+        Expected value of a turn (roll and two rerolls) when ending
+        it on each roll is worth final_values
+        """
+        roll_values = self.reroll_values(self.reroll_values(final_values))
+        if numpy != None:
+            return float(self.first_roll_array.dot(roll_values))
+        return sum([self.first_roll[roll] * roll_values[roll] for roll in range(len(self.rolls))])
+
+TURN_TABLES = []
+
+def get_turn_tables():
+    """
+    Return the TurnTables, built on the first call
+    """
+    if not TURN_TABLES:
+        TURN_TABLES.append(TurnTables())
+    return TURN_TABLES[0]
+
+def final_values(tables, open_categories, upper, game_values):
+    """
+    Value of ending a turn on each roll: the best open category
+    score plus, if game_values is given, the value of the next
+    game state (game_values maps an open categories mask to the
+    UPPER_STATES values of that mask)
+    """
+    open_list = [category for category in range(len(CATEGORIES))
+                 if open_categories & (1 << category)]
+    if numpy != None:
+        columns = []
+        for category in open_list:
+            column = tables.score_array[:, category]
+            if game_values is not None:
+                next_values = game_values[open_categories & ~(1 << category)]
+                if category < NUM_UPPER:
+                    column = column + next_values[numpy.minimum(column.astype(int) + upper,
+                                                                UPPER_BONUS_THRESHOLD)]
+                else:
+                    column = column + next_values[upper]
+            columns.append(column)
+        return numpy.max(columns, axis = 0)
+    values = []
+    for roll in range(len(tables.rolls)):
+        best = None
+        for category in open_list:
+            value = tables.scores[roll][category]
+            if game_values is not None:
+                next_upper = upper
+                if category < NUM_UPPER:
+                    next_upper = min(upper + value, UPPER_BONUS_THRESHOLD)
+                value += game_values[open_categories & ~(1 << category)][next_upper]
+            if best == None or value > best:
+                best = value
+        values.append(best)
+    return values
+
+def turn_strategy(hand, rolls_left, open_categories = ALL_CATEGORIES, upper = 0,
+                  game_values = None):
+    """
+    Best play for a 5 dice hand with rolls_left rerolls left.
+    Without game_values it maximizes the score of this turn, with
+    game_values (game_value_rows of the solve_game values) the
+    expected rest of the game.
+
+    Returns (expected value, tuple of dice to hold) when rolls_left
+    is positive, (value, category name) otherwise
+    """
+    tables = get_turn_tables()
+    roll = tables.roll_index[tuple(sorted(hand))]
+    if rolls_left == 0:
+        best = None
+        for category in range(len(CATEGORIES)):
+            if open_categories & (1 << category):
+                value = tables.scores[roll][category]
+                if game_values is not None:
+                    next_upper = upper
+                    if category < NUM_UPPER:
+                        next_upper = min(upper + value, UPPER_BONUS_THRESHOLD)
+                    value += game_values[open_categories & ~(1 << category)][next_upper]
+                if best == None or value > best[0]:
+                    best = (float(value), CATEGORIES[category])
+        return best
+    values = final_values(tables, open_categories, upper, game_values)
+    for dummy_roll in range(rolls_left - 1):
+        values = tables.reroll_values(values)
+    hold_values = tables.hold_values(values)
+    best_hold = max(tables.roll_holds[roll], key = lambda hold: hold_values[hold])
+    return (float(hold_values[best_hold]), tables.holds[best_hold])
+
+def game_state_value(tables, open_categories, upper, game_values):
+    """
+    Expected remaining score of a game state at the start of a turn
+    """
+    if open_categories == 0:
+        return UPPER_BONUS if upper >= UPPER_BONUS_THRESHOLD else 0
+    return tables.turn_value(final_values(tables, open_categories, upper, game_values))
+
+def solve_game_chunk(task):
+    """
+    Pool worker: values of the (open categories, upper) states of
+    task, given the values of the states with one less open category
+    """
+    states, game_values = task
+    tables = get_turn_tables()
+    return [game_state_value(tables, open_categories, upper, game_values)
+            for open_categories, upper in states]
+
+def game_value_rows(values):
+    """
+    View of the value array of solve_game as rows[open categories][upper]
+    """
+    if numpy != None:
+        return numpy.frombuffer(values, dtype = float).reshape((ALL_CATEGORIES + 1, UPPER_STATES))
+    return [values[mask * UPPER_STATES:(mask + 1) * UPPER_STATES]
+            for mask in range(ALL_CATEGORIES + 1)]
+
+def solve_game(categories = ALL_CATEGORIES, num_workers = None, chunk_size = 16):
+    """
+    Expected final score of every game state of optimal play, state
+    by state from the full scorecard back to the empty one.  Only
+    the categories in the categories mask are played.  The states
+    with the same number of open categories do not depend on each
+    other, so each of these layers is split in chunks of chunk_size
+    masks for a process pool (num_workers = 1 solves in this
+    process).  A chunk carries only the rows of the previous layer
+    it looks up.
+
+    Returns (expected score of the game, array of the values of
+    every state, indexed by open categories * UPPER_STATES + upper)
+    """
+    values = array.array("d", [0.0]) * ((ALL_CATEGORIES + 1) * UPPER_STATES)
+    pool = None
+    if num_workers != 1 and multiprocessing != None:
+        pool = multiprocessing.Pool(num_workers)
+    try:
+        masks = [mask for mask in range(ALL_CATEGORIES + 1) if mask & ~categories == 0]
+        previous = {}
+        for num_open in range(bin(categories).count("1") + 1):
+            layer = [mask for mask in masks if bin(mask).count("1") == num_open]
+            tasks = []
+            for start in range(0, len(layer), chunk_size):
+                states = []
+                rows = {}
+                for mask in layer[start:start + chunk_size]:
+                    # the upper total can not exceed what the filled
+                    # upper categories can score
+                    max_upper = sum([5 * (category + 1) for category in range(NUM_UPPER)
+                                     if categories & ~mask & (1 << category)])
+                    states.extend([(mask, upper) for upper in
+                                   range(min(max_upper, UPPER_BONUS_THRESHOLD) + 1)])
+                    for category in range(len(CATEGORIES)):
+                        if mask & (1 << category):
+                            rows[mask & ~(1 << category)] = previous[mask & ~(1 << category)]
+                tasks.append((states, rows))
+            if pool != None:
+                results = pool.map(solve_game_chunk, tasks)
+            else:
+                results = [solve_game_chunk(task) for task in tasks]
+            # the upper totals above a row's bound are never looked up
+            previous = {}
+            for task, result in zip(tasks, results):
+                for (mask, upper), value in zip(task[0], result):
+                    values[mask * UPPER_STATES + upper] = value
+                    if mask not in previous:
+                        previous[mask] = [0.0] * UPPER_STATES
+                    previous[mask][upper] = value
+            if numpy != None:
+                for mask in previous:
+                    previous[mask] = numpy.array(previous[mask])
+    finally:
+        if pool != None:
+            pool.close()
+            pool.join()
+    return values[categories * UPPER_STATES], values
+
 def run_example():
     """
     Compute the dice to hold and expected score for an example hand
@@ -143,6 +778,7 @@ def run_example():
 #print gen_all_holds((1,2,3,4,5))
 #print [index + 1 for index in range(6)]
 #print expected_value((2, 2), 6, 2)
+#print turn_strategy((1, 1, 1, 5, 6), 2)
 #import poc_holds_testsuite
 #poc_holds_testsuite.run_suite(gen_all_holds)
 print strategy((1,), 6)
@@ -2,11 +2,24 @@
 Student portion of Zombie Apocalypse mini-project
 """
 
+import heapq
 import random
 import poc_grid
 import poc_queue
 #import poc_zombie_gui
 
+# array and numpy are only used by DistanceFieldEngine, which falls
+# back to lists without them
+try:
+    import array
+except ImportError:
+    array = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # global constants
 EMPTY = 0 
 FULL = 1
@@ -30,6 +43,10 @@ class Zombie(poc_grid.Grid):
         humans, and zombies
         """
         poc_grid.Grid.__init__(self, grid_height, grid_width)
+        self._engine = DistanceFieldEngine(grid_height, grid_width)
+        # entity type -> IncrementalDistanceField, see
+        # incremental_distance_field
+        self._fields = {}
         if obstacle_list != None:
             for cell in obstacle_list:
                 self.set_full(cell[0], cell[1])
@@ -55,14 +72,36 @@ class Zombie(poc_grid.Grid):
         Reset zombie and human lists to be empty
         """
         poc_grid.Grid.clear(self)
+        self._engine.clear()
+        self._fields = {}
         self._human_list = []
         self._zombie_list = []
 
+    def set_empty(self, row, col):
+        """
+        Set cell with index (row, col) to be empty
+        """
+        poc_grid.Grid.set_empty(self, row, col)
+        self._engine.set_blocked(row, col, False)
+        for field in self._fields.values():
+            field.cell_changed(row, col)
+
+    def set_full(self, row, col):
+        """
+        Set cell with index (row, col) to be full
+        """
+        poc_grid.Grid.set_full(self, row, col)
+        self._engine.set_blocked(row, col, True)
+        for field in self._fields.values():
+            field.cell_changed(row, col)
+
     def add_zombie(self, row, col):
         """
         Add zombie to the zombie list
         """
         self._zombie_list.append((row, col))
+        if ZOMBIE in self._fields:
+            self._fields[ZOMBIE].add_source(row, col)
                 
     def num_zombies(self):
         """
@@ -84,6 +123,8 @@ class Zombie(poc_grid.Grid):
         Add human to the human list
         """
         self._human_list.append((row, col))
+        if HUMAN in self._fields:
+            self._fields[HUMAN].add_source(row, col)
         
     def num_humans(self):
         """
@@ -105,6 +146,50 @@ class Zombie(poc_grid.Grid):
         Distance at member of entity_queue is zero
         Shortest paths avoid obstacles and use distance_type distances
         """
+        return self._engine.to_lists(self.compute_distance_field_flat(entity_type))
+
+    def compute_distance_field_flat(self, entity_type):
+        """
+        compute_distance_field without the conversion to a 2D list:
+        returns the engine's flat buffer, indexed by
+        self.get_engine().index(row, col).  It is overwritten by the
+        next computation.
+        """
+        if entity_type == HUMAN:
+            entity_list = self._human_list
+        elif entity_type == ZOMBIE:
+            entity_list = self._zombie_list
+        return self._engine.compute(entity_list)
+
+    def incremental_distance_field(self, entity_type):
+        """
+        Distance field of entity_type that is repaired, instead of
+        recomputed, after the entity additions and moves and the
+        obstacle edits since the previous call.  Returns a
+        DistanceFieldView, indexed like the compute_distance_field
+        lists, that move_humans and move_zombies accept.
+        """
+        if entity_type not in self._fields:
+            if entity_type == HUMAN:
+                entity_list = self._human_list
+            elif entity_type == ZOMBIE:
+                entity_list = self._zombie_list
+            self._fields[entity_type] = IncrementalDistanceField(self._engine, entity_list)
+        field = self._fields[entity_type]
+        field.update()
+        return field.get_view()
+
+    def get_engine(self):
+        """
+        Return the DistanceFieldEngine of the grid
+        """
+        return self._engine
+
+    def compute_distance_field_lists(self, entity_type):
+        """
+        compute_distance_field on nested lists and poc_queue.Queue,
+        kept as the reference implementation
+        """
         visited = [[0 for dummy_col in range(self._grid_width)] 
                     for dummy_row in range(self._grid_height)]
         infi = self._grid_height * self._grid_width
@@ -141,6 +226,8 @@ class Zombie(poc_grid.Grid):
             moves.append((human[0], human[1]))
             max_move = max_distance_move(moves, zombie_distance)
             tmp_humans.append(max_move)
+        if HUMAN in self._fields:
+            self._fields[HUMAN].move_sources(self._human_list, tmp_humans)
         self._human_list = tmp_humans
     
     def move_zombies(self, human_distance):
@@ -154,8 +241,406 @@ class Zombie(poc_grid.Grid):
             moves.append((zombie[0], zombie[1]))
             min_move = min_distance_move(moves, human_distance)
             tmp_zombies.append(min_move)
+        if ZOMBIE in self._fields:
+            self._fields[ZOMBIE].move_sources(self._zombie_list, tmp_zombies)
         self._zombie_list = tmp_zombies
+
+class DistanceFieldEngine:
+    """
+    Breadth-first distance fields on a flat buffer.  The grid is
+    padded with a border of blocked cells, so the four neighbors of
+    a cell are at fixed offsets and need no bounds checks.  The
+    buffers (distances, obstacle mask, queue) are allocated once
+    and reused by every computation.  With numpy the search expands
+    a whole BFS level per step, otherwise it runs a single-pass
+    ring buffer queue over array buffers.
+    """
+    def __init__(self, grid_height, grid_width):
+        self._grid_height = grid_height
+        self._grid_width = grid_width
+        self._stride = grid_width + 2
+        self._size = (grid_height + 2) * self._stride
+        self._infinity = grid_height * grid_width
+        self._offsets = (-self._stride, self._stride, -1, 1)
+        if array != None:
+            self._blocked = array.array("B", [0]) * self._size
+            self._queue = array.array("i", [0]) * self._size
+        else:
+            self._blocked = [0] * self._size
+            self._queue = [0] * self._size
+        self.clear()
+        if numpy != None:
+            self._distance = numpy.empty(self._size, dtype = numpy.int32)
+            self._offsets_array = numpy.array(self._offsets)
+            if array != None:
+                self._blocked_array = numpy.frombuffer(self._blocked, dtype = numpy.uint8)
+            else:
+                self._blocked_array = None
+        elif array != None:
+            self._distance = array.array("i", [0]) * self._size
+            self._infinity_field = array.array("i", [self._infinity]) * self._size
+        else:
+            self._distance = [0] * self._size
+            self._infinity_field = [self._infinity] * self._size
+
+    def index(self, row, col):
+        """
+        Index of cell (row, col) in the flat buffers
+        """
+        return (row + 1) * self._stride + col + 1
+
+    def clear(self):
+        """
+        Unblock every cell of the grid, the border stays blocked
+        """
+        for index in range(self._size):
+            self._blocked[index] = 0
+        for col in range(self._stride):
+            self._blocked[col] = 1
+            self._blocked[self._size - 1 - col] = 1
+        for row in range(self._grid_height + 2):
+            self._blocked[row * self._stride] = 1
+            self._blocked[row * self._stride + self._stride - 1] = 1
+
+    def set_blocked(self, row, col, blocked):
+        """
+        Mark cell (row, col) as an obstacle or not
+        """
+        self._blocked[self.index(row, col)] = 1 if blocked else 0
+
+    def cell(self, index):
+        """
+        (row, col) of a flat buffer index
+        """
+        row, col = divmod(index, self._stride)
+        return (row - 1, col - 1)
+
+    def get_size(self):
+        """
+        Return the size of the flat buffers
+        """
+        return self._size
+
+    def get_stride(self):
+        """
+        Return the length of a row of the flat buffers
+        """
+        return self._stride
+
+    def get_infinity(self):
+        """
+        Return the distance of unreachable cells
+        """
+        return self._infinity
+
+    def get_offsets(self):
+        """
+        Return the flat index offsets of the four neighbors
+        """
+        return self._offsets
+
+    def get_blocked(self):
+        """
+        Return the flat obstacle mask (the border is blocked)
+        """
+        return self._blocked
+
+    def compute(self, sources):
+        """
+        Distance field of the (row, col) sources in the flat buffer,
+        as compute_distance_field: sources are at 0 (even on an
+        obstacle), unreachable cells at grid height * grid width
+        """
+        if numpy != None:
+            return self.compute_numpy(sources)
+        distance = self._distance
+        distance[:] = self._infinity_field
+        blocked = self._blocked
+        queue = self._queue
+        infinity = self._infinity
+        up_offset, down_offset, left_offset, right_offset = self._offsets
+        # every cell is enqueued at most once, so head and tail never wrap
+        tail = 0
+        for row, col in sources:
+            index = (row + 1) * self._stride + col + 1
+            if distance[index] != 0:
+                distance[index] = 0
+                queue[tail] = index
+                tail += 1
+        head = 0
+        while head < tail:
+            index = queue[head]
+            head += 1
+            next_distance = distance[index] + 1
+            for neighbor in (index + up_offset, index + down_offset,
+                             index + left_offset, index + right_offset):
+                if distance[neighbor] == infinity and not blocked[neighbor]:
+                    distance[neighbor] = next_distance
+                    queue[tail] = neighbor
+                    tail += 1
+        return distance
+
+    def compute_numpy(self, sources):
+        """
+        compute with numpy, one BFS level at a time
+        """
+        distance = self._distance
+        distance.fill(self._infinity)
+        blocked = self._blocked_array
+        if blocked is None:
+            blocked = numpy.array(self._blocked, dtype = numpy.uint8)
+        if not sources:
+            return distance
+        frontier = numpy.unique(numpy.array([self.index(row, col) for row, col in sources]))
+        distance[frontier] = 0
+        level = 0
+        while len(frontier):
+            level += 1
+            neighbors = (frontier[:, numpy.newaxis] + self._offsets_array).ravel()
+            neighbors = neighbors[(distance[neighbors] == self._infinity) & (blocked[neighbors] == 0)]
+            frontier = numpy.unique(neighbors)
+            distance[frontier] = level
+        return distance
+
+    def to_lists(self, distance):
+        """
+        Convert a flat distance buffer to compute_distance_field's
+        list of rows
+        """
+        if numpy != None:
+            return distance.reshape((self._grid_height + 2, self._stride))[1:-1, 1:-1].tolist()
+        return [list(distance[self.index(row, 0):self.index(row, self._grid_width)])
+                for row in range(self._grid_height)]
         
+class IncrementalDistanceField:
+    """
+    Distance field of a set of sources (same values as
+    DistanceFieldEngine.compute) kept in its own flat buffer and
+    repaired after changes.  add_source, remove_source,
+    move_sources and cell_changed (for obstacle edits) record the
+    changed cells; update repairs the field:
+
+    - cells whose distance goes up (lost source, new obstacle) are
+      invalidated together with the cells that only got their
+      distance through them,
+    - the invalidated cells restart from their valid neighbors and
+      the decreases are propagated, closest first.
+
+    The work is proportional to the cells whose distance changes.
+    When the changes or the work go over max_fraction of the grid
+    the field is recomputed with the engine instead.  A removed
+    source changes about its share of the grid, so many moves go
+    straight to the recompute.  The default fraction is smaller
+    with numpy, whose recompute is much cheaper per cell.
+    """
+    def __init__(self, engine, sources, max_fraction = None):
+        if max_fraction == None:
+            max_fraction = 0.02 if numpy != None else 0.25
+        self._engine = engine
+        self._max_work = max(1, int(max_fraction * engine.get_size()))
+        if numpy != None and array != None:
+            self._distance = array.array("i", [0]) * engine.get_size()
+        else:
+            self._distance = [0] * engine.get_size()
+        self._view = None
+        self.repairs = 0
+        self.recomputes = 0
+        self.recompute([engine.index(row, col) for row, col in sources])
+
+    def recompute(self, sources):
+        """
+        Compute the field of the sources (flat indexes) from scratch
+        """
+        self.recomputes += 1
+        self._counts = {}
+        for index in sources:
+            self._counts[index] = self._counts.get(index, 0) + 1
+        distance = self._engine.compute([self._engine.cell(index) for index in self._counts])
+        # written in place, so a view of the field stays valid
+        if numpy != None and array != None:
+            numpy.frombuffer(self._distance, dtype = numpy.int32)[:] = distance
+        elif numpy != None:
+            self._distance[:] = distance.tolist()
+        else:
+            self._distance[:] = distance
+        self._changed = set()
+        self._removed = 0
+
+    def add_source(self, row, col):
+        """
+        Add a source at (row, col)
+        """
+        index = self._engine.index(row, col)
+        self._counts[index] = self._counts.get(index, 0) + 1
+        self._changed.add(index)
+
+    def remove_source(self, row, col):
+        """
+        Remove one source at (row, col)
+        """
+        index = self._engine.index(row, col)
+        self._counts[index] -= 1
+        if self._counts[index] == 0:
+            del self._counts[index]
+        self._changed.add(index)
+        self._removed += 1
+
+    def move_sources(self, old_sources, new_sources):
+        """
+        Move the sources from old_sources to new_sources (two lists
+        of the same entities, in the same order)
+        """
+        for old_cell, new_cell in zip(old_sources, new_sources):
+            if old_cell != new_cell:
+                self.remove_source(old_cell[0], old_cell[1])
+                self.add_source(new_cell[0], new_cell[1])
+
+    def cell_changed(self, row, col):
+        """
+        Record that cell (row, col) was set full or empty
+        """
+        self._changed.add(self._engine.index(row, col))
+
+    def target(self, index):
+        """
+        Distance of a cell computed from its neighbors
+        """
+        if index in self._counts:
+            return 0
+        infinity = self._engine.get_infinity()
+        if self._engine.get_blocked()[index]:
+            return infinity
+        distance = self._distance
+        best = infinity
+        for offset in self._engine.get_offsets():
+            if distance[index + offset] < best:
+                best = distance[index + offset]
+        return min(best + 1, infinity)
+
+    def update(self):
+        """
+        Bring the field up to date with the recorded changes
+        """
+        if not self._changed:
+            return
+        estimate = self._removed * self._engine.get_size() // max(1, len(self._counts))
+        if (len(self._changed) > self._max_work or estimate > self._max_work
+            or not self.repair()):
+            self.recompute([index for index in self._counts
+                            for dummy_count in range(self._counts[index])])
+        else:
+            self.repairs += 1
+        self._changed = set()
+        self._removed = 0
+
+    def repair(self):
+        """
+        Repair the field after the changed cells, returns False if
+        it took too much work (the field is then inconsistent)
+        """
+        distance = self._distance
+        blocked = self._engine.get_blocked()
+        offsets = self._engine.get_offsets()
+        infinity = self._engine.get_infinity()
+        counts = self._counts
+        raised = []
+        lowered = []
+        for index in self._changed:
+            value = self.target(index)
+            if value < distance[index]:
+                lowered.append(index)
+            elif value > distance[index]:
+                raised.append(index)
+        # invalidate the cells that only reached a source through a
+        # raised cell: a neighbor one step further that has no other
+        # neighbor one step closer
+        invalid = set()
+        while raised:
+            index = raised.pop()
+            if index in invalid:
+                continue
+            old = distance[index]
+            invalid.add(index)
+            distance[index] = infinity
+            if len(invalid) > self._max_work:
+                return False
+            if old >= infinity - 1:
+                continue
+            for offset in offsets:
+                neighbor = index + offset
+                if distance[neighbor] == old + 1 and neighbor not in counts:
+                    supported = False
+                    for other in offsets:
+                        if distance[neighbor + other] == old:
+                            supported = True
+                            break
+                    if not supported:
+                        raised.append(neighbor)
+        # restart the invalid cells from their valid neighbors and
+        # propagate every decrease, closest first
+        heap = []
+        for index in invalid:
+            distance[index] = self.target(index)
+            if distance[index] < infinity:
+                heap.append((distance[index], index))
+        for index in lowered:
+            value = self.target(index)
+            if value < distance[index]:
+                distance[index] = value
+                heap.append((value, index))
+        heapq.heapify(heap)
+        work = len(invalid)
+        while heap:
+            value, index = heapq.heappop(heap)
+            if value != distance[index]:
+                continue
+            work += 1
+            if work > 2 * self._max_work:
+                return False
+            for offset in offsets:
+                neighbor = index + offset
+                if value + 1 < distance[neighbor] and not blocked[neighbor]:
+                    distance[neighbor] = value + 1
+                    heapq.heappush(heap, (value + 1, neighbor))
+        return True
+
+    def get_distance(self):
+        """
+        Return the flat distance buffer
+        """
+        return self._distance
+
+    def get_view(self):
+        """
+        Return a DistanceFieldView of the field
+        """
+        if self._view == None:
+            self._view = DistanceFieldView(self._distance, self._engine.get_stride())
+        return self._view
+
+class DistanceFieldView:
+    """
+    Read-only view of a flat distance buffer, indexed like the
+    compute_distance_field lists: view[row][col]
+    """
+    def __init__(self, distance, stride):
+        self._distance = distance
+        self._stride = stride
+
+    def __getitem__(self, row):
+        return DistanceFieldRow(self._distance, (row + 1) * self._stride + 1)
+
+class DistanceFieldRow:
+    """
+    One row of a DistanceFieldView
+    """
+    def __init__(self, distance, start):
+        self._distance = distance
+        self._start = start
+
+    def __getitem__(self, col):
+        return self._distance[self._start + col]
+
 def max_distance_move(moves, distance):
     """
     Find max_distance_move
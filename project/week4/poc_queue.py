@@ -2,23 +2,37 @@
 Queue class
 """
 
+import collections
+import time
+
+class QueueFull(Exception):
+    """
+    Raised by enqueue when a bounded queue is full.
+    """
+    pass
+
 class Queue:
     """
     A simple implementation of a FIFO queue.
+    The items are kept in a collections.deque, so enqueue and
+    dequeue are O(1).  A queue with a capacity refuses items when
+    it is full instead of dropping old ones.
     """
 
-    def __init__(self):
-        """ 
+    def __init__(self, capacity = None):
+        """
         Initialize the queue.
+        capacity is the maximum number of items, None for no limit.
         """
-        self._items = []
+        self._items = collections.deque()
+        self._capacity = capacity
 
     def __len__(self):
         """
         Return the number of items in the queue.
         """
         return len(self._items)
-    
+
     def __iter__(self):
         """
         Create an iterator for the queue.
@@ -30,23 +44,86 @@ class Queue:
         """
         Return a string representation of the queue.
         """
-        return str(self._items)
+        return str(list(self._items))
+
+    def get_capacity(self):
+        """
+        Return the capacity of the queue (None for no limit).
+        """
+        return self._capacity
+
+    def is_full(self):
+        """
+        Return True if a bounded queue can not take more items.
+        """
+        return self._capacity != None and len(self._items) >= self._capacity
 
     def enqueue(self, item):
         """
         Add item to the queue.
-        """        
+        Raises QueueFull if the queue is full.
+        """
+        if self.is_full():
+            raise QueueFull("queue is full")
         self._items.append(item)
 
+    def enqueue_many(self, items):
+        """
+        Add the items to the queue, in order, until it is full.
+        Returns the number of items added, the caller keeps the rest.
+        """
+        if self._capacity == None:
+            before = len(self._items)
+            self._items.extend(items)
+            return len(self._items) - before
+        added = 0
+        for item in items:
+            if len(self._items) >= self._capacity:
+                break
+            self._items.append(item)
+            added += 1
+        return added
+
     def dequeue(self):
         """
         Remove and return the least recently inserted item.
         """
-        return self._items.pop(0)
+        return self._items.popleft()
+
+    def dequeue_many(self, count):
+        """
+        Remove and return (as a list) the count least recently
+        inserted items, or all of them if there are fewer.
+        """
+        popleft = self._items.popleft
+        return [popleft() for dummy_index in range(min(count, len(self._items)))]
 
     def clear(self):
         """
         Remove all items from the queue.
         """
-        self._items = []
-        
+        self._items.clear()
+
+def run_benchmark(num_items = 1000000):
+    """
+    Time enqueue/dequeue of num_items items one at a time and in
+    bulk, and of a tenth as many, to show the time per item stays
+    the same.
+    """
+    for size in (num_items // 10, num_items):
+        queue = Queue()
+        start = time.time()
+        for item in xrange(size):
+            queue.enqueue(item)
+        while len(queue):
+            queue.dequeue()
+        single = time.time() - start
+        start = time.time()
+        queue.enqueue_many(xrange(size))
+        while len(queue):
+            queue.dequeue_many(1000)
+        bulk = time.time() - start
+        print size, "items:", single, "s one by one,", bulk, "s in bulk,",
+        print 1e9 * single / size, "ns per item"
+
+#run_benchmark()